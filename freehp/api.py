@@ -0,0 +1,271 @@
+# coding=utf-8
+
+import os
+import math
+import mmap
+import json
+import struct
+import signal
+import asyncio
+import hashlib
+import logging
+from operator import attrgetter
+from collections import OrderedDict, namedtuple
+from asyncio import CancelledError
+
+from aiohttp import web
+
+from freehp.judge import add_judge_routes
+from freehp.utils import configure_logging, unpack_addr
+
+log = logging.getLogger(__name__)
+
+POOL_MAGIC = b'FREEHPP2'
+# magic, generation, number of proxies
+POOL_HEADER = struct.Struct('<8sQQ')
+# packed address, good, bad, anonymity, https, post, check time, latency
+POOL_RECORD = struct.Struct('<QIIBBBxqd')
+POOL_POSITION = struct.Struct('<I')
+
+PoolProxy = namedtuple('PoolProxy', ['addr', 'good', 'bad', 'anonymity', 'https', 'post', 'check_time', 'latency'])
+
+
+class ProxiesEndpoint:
+    """
+    Serve GET /proxies from a proxy queue, responses are cached until the generation of the queue changes.
+    """
+
+    def __init__(self, cache_size=128):
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_generation = None
+
+    async def handle(self, request, proxy_queue):
+        params = request.rel_url.query
+        count = params.get("count", 0)
+        if count:
+            count = int(count)
+        kwargs = {}
+        if 'order' in params:
+            kwargs['order'] = params.get('order')
+        if 'detail' in params:
+            kwargs['detail'] = True
+        if 'https' in params:
+            kwargs['https'] = True
+        if 'post' in params:
+            kwargs['post'] = True
+        min_anonymity = params.get('min_anonymity')
+        if min_anonymity is not None:
+            kwargs['min_anonymity'] = int(min_anonymity)
+        log.info('GET /proxies %s', kwargs)
+        body, etag = self.get_response(proxy_queue, count, **kwargs)
+        headers = {'ETag': etag}
+        if etag in request.headers.get('If-None-Match', ''):
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body,
+                            headers=headers,
+                            charset="utf-8",
+                            content_type="application/json")
+
+    def get_response(self, proxy_queue, count, detail=False, order='rate', https=False, post=False,
+                     min_anonymity=0):
+        generation = proxy_queue.generation
+        if generation != self._cache_generation:
+            self._cache.clear()
+            self._cache_generation = generation
+        key = (max(count, 0), order, detail, https, post, min_anonymity)
+        res = self._cache.get(key)
+        if res is not None:
+            self._cache.move_to_end(key)
+            return res
+        proxy_list = self.get_proxies(proxy_queue, count, detail=detail, order=order, https=https, post=post,
+                                      min_anonymity=min_anonymity)
+        body = json.dumps(proxy_list).encode("utf-8")
+        etag = '"{:x}-{}"'.format(generation, hashlib.md5(body).hexdigest())
+        res = (body, etag)
+        self._cache[key] = res
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return res
+
+    @staticmethod
+    def get_proxies(proxy_queue, count, detail=False, order='rate', https=False, post=False, min_anonymity=0):
+        t = proxy_queue.get_proxies(count, order=order, https=https, post=post, min_anonymity=min_anonymity)
+        res = []
+        for p in t:
+            if detail:
+                res.append({"address": p.addr, "success": p.good, "fail": p.bad,
+                            'timestamp': p.check_time, 'latency': _round_latency(p.latency),
+                            'anonymity': p.anonymity, 'https': p.https, 'post': p.post})
+            else:
+                res.append(p.addr)
+        return res
+
+
+def _round_latency(latency):
+    return None if latency is None else round(latency, 3)
+
+
+_pool_fields = attrgetter('key', 'good', 'bad', 'anonymity', 'https', 'post', 'check_time', 'latency')
+_pool_key = attrgetter('key')
+
+
+def get_pool_records(proxy_queue):
+    """
+    Copy the fields of the available proxies in the order of rate, along with the keys in the order of check time.
+    The copy can be packed off the event loop.
+    """
+    return (proxy_queue.generation, list(map(_pool_fields, proxy_queue.get_proxies(order='rate'))),
+            list(map(_pool_key, proxy_queue.get_proxies(order='time'))))
+
+
+def pack_pool(generation, records, time_keys):
+    """
+    Pack the records in the order of rate, followed by their positions in the order of check time.
+    """
+    positions = {r[0]: i for i, r in enumerate(records)}
+    buf = bytearray(POOL_HEADER.size + len(records) * (POOL_RECORD.size + POOL_POSITION.size))
+    POOL_HEADER.pack_into(buf, 0, POOL_MAGIC, generation, len(records))
+    offset = POOL_HEADER.size
+    nan = float('nan')
+    for key, good, bad, anonymity, https, post, check_time, latency in records:
+        POOL_RECORD.pack_into(buf, offset, key, good, bad, anonymity, https, post, check_time,
+                              nan if latency is None else latency)
+        offset += POOL_RECORD.size
+    for key in time_keys:
+        POOL_POSITION.pack_into(buf, offset, positions[key])
+        offset += POOL_POSITION.size
+    return bytes(buf)
+
+
+def publish_pool(fname, generation, records, time_keys):
+    dump_pool(fname, pack_pool(generation, records, time_keys))
+
+
+def dump_pool(fname, data):
+    """
+    Publish the pool as an immutable file, readers map the file into memory and pick up a new one once it has
+    been atomically replaced.
+    """
+    tmp_file = '{}.{}.tmp'.format(fname, os.getpid())
+    with open(tmp_file, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_file, fname)
+
+
+def open_pool(fname):
+    with open(fname, 'rb') as f:
+        return ProxyPool(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+class ProxyPool:
+    """
+    Read-only view of a packed pool, records are unpacked on demand thus nothing is rebuilt when a new pool is
+    published.
+    """
+
+    def __init__(self, data):
+        self._data = data
+        magic, self.generation, self._size = POOL_HEADER.unpack_from(data)
+        if magic != POOL_MAGIC:
+            raise ValueError('Invalid pool data')
+        self._time_offset = POOL_HEADER.size + self._size * POOL_RECORD.size
+
+    def __len__(self):
+        return self._size
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+    def get_proxies(self, count=0, order=None, https=False, post=False, min_anonymity=0):
+        if count <= 0 or count > self._size:
+            count = self._size
+        res = []
+        if count == 0:
+            return res
+        data = self._data
+        for i in range(self._size):
+            if order == 'time':
+                i = POOL_POSITION.unpack_from(data, self._time_offset + i * POOL_POSITION.size)[0]
+            key, good, bad, anonymity, is_https, is_post, check_time, latency = \
+                POOL_RECORD.unpack_from(data, POOL_HEADER.size + i * POOL_RECORD.size)
+            if anonymity < min_anonymity or (https and not is_https) or (post and not is_post):
+                continue
+            res.append(PoolProxy(unpack_addr(key), good, bad, anonymity, bool(is_https), bool(is_post), check_time,
+                                 None if math.isnan(latency) else latency))
+            if len(res) >= count:
+                break
+        return res
+
+
+class ApiServer:
+    """
+    Serve the API in a separate process from the pool published by the manager.
+    """
+
+    def __init__(self, config, loop=None):
+        self.config = config
+        self.loop = loop or asyncio.get_event_loop()
+        self._pool_file = config.get('api_pool_file')
+        self._refresh_interval = config.getfloat('api_publish_interval') / 2
+        self._endpoint = ProxiesEndpoint(config.getint('response_cache_size'))
+        self._pool = ProxyPool(POOL_HEADER.pack(POOL_MAGIC, 0, 0))
+        self._pool_stat = None
+
+    def run(self, sock=None):
+        app = web.Application(logger=log, loop=self.loop)
+        app.router.add_route("GET", "/proxies", self.get_proxies)
+        if self.config.getbool('judge'):
+            add_judge_routes(app, prefix='/judge')
+        runner = web.AppRunner(app, access_log=None)
+        self.loop.run_until_complete(runner.setup())
+        if sock is not None:
+            site = web.SockSite(runner, sock)
+        else:
+            host, port = self.config.get('bind').split(':')
+            site = web.TCPSite(runner, host=host, port=int(port), reuse_port=True)
+        self.loop.run_until_complete(site.start())
+        refresh = asyncio.ensure_future(self._refresh_task(), loop=self.loop)
+        self.loop.add_signal_handler(signal.SIGTERM, self.loop.stop)
+        try:
+            self.loop.run_forever()
+        finally:
+            refresh.cancel()
+            self.loop.run_until_complete(runner.cleanup())
+
+    async def get_proxies(self, request):
+        return await self._endpoint.handle(request, self._pool)
+
+    async def _refresh_task(self):
+        while True:
+            try:
+                self._refresh()
+            except CancelledError:
+                raise
+            except Exception:
+                log.warning("Failed to load the pool file '%s'", self._pool_file, exc_info=True)
+            await asyncio.sleep(self._refresh_interval, loop=self.loop)
+
+    def _refresh(self):
+        try:
+            st = os.stat(self._pool_file)
+        except FileNotFoundError:
+            return
+        stat = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if stat != self._pool_stat:
+            pool, self._pool = self._pool, open_pool(self._pool_file)
+            self._pool_stat = stat
+            pool.close()
+
+
+def run_api_server(config, sock=None):
+    # the manager process handles SIGINT and terminates the API processes on shutdown
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    configure_logging('freehp', config)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        ApiServer(config, loop=loop).run(sock)
+    finally:
+        loop.close()
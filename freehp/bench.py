@@ -0,0 +1,302 @@
+# coding=utf-8
+
+import gc
+import json
+import time
+import random
+import socket
+import asyncio
+import logging
+import platform
+import tracemalloc
+
+import aiohttp
+from aiohttp import web
+import async_timeout
+
+from freehp.api import ProxiesEndpoint
+from freehp.checker import HttpbinChecker
+from freehp.extractor import extract_proxies
+from freehp.judge import make_judge_app
+from freehp.manager import ProxyQueue, ProxyInfo, RecheckPolicy
+from freehp.version import __version__
+
+log = logging.getLogger(__name__)
+
+QUEUE_SIZES = [10000, 100000, 1000000]
+PAGE_SIZES = [100, 1000, 10000]
+PAGE_LAYOUTS = ['table', 'text', 'noisy']
+QUERY_FILTERS = [{}, {'https': True}, {'post': True}, {'min_anonymity': 2}, {'https': True, 'min_anonymity': 1}]
+QUERY_ORDERS = [None, 'rate', 'time']
+QUERY_COUNTS = [20, 0]
+
+
+def summarize(name, params, latencies, total_time, peak_memory=None):
+    latencies = sorted(latencies)
+    n = len(latencies)
+
+    def percentile(q):
+        return latencies[min(n - 1, int(q * n))] if n > 0 else None
+
+    return {'name': name,
+            'params': params,
+            'ops': n,
+            'ops_per_sec': n / total_time if total_time > 0 else None,
+            'latency': {'mean': sum(latencies) / n if n > 0 else None,
+                        'p50': percentile(0.5), 'p90': percentile(0.9), 'p99': percentile(0.99),
+                        'max': latencies[-1] if n > 0 else None},
+            'peak_memory': peak_memory}
+
+
+def run_case(name, params, state, op, ops, memory=True):
+    """
+    Time each call of ``op(state, i)``, then call it another ``ops`` times under tracemalloc to measure the peak
+    memory allocated by the calls, thus ``op`` must be able to run ``2 * ops`` times on the same state.
+    """
+    gc.collect()
+    latencies = []
+    perf_counter = time.perf_counter
+    start_time = perf_counter()
+    for i in range(ops):
+        t = perf_counter()
+        op(state, i)
+        latencies.append(perf_counter() - t)
+    total_time = perf_counter() - start_time
+    peak_memory = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            for i in range(ops, 2 * ops):
+                op(state, i)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    res = summarize(name, params, latencies, total_time, peak_memory)
+    log.info('%s %s: %.1f ops/sec', name, params, res['ops_per_sec'] or 0)
+    return res
+
+
+def make_addr(i):
+    return '{}.{}.{}.{}:{}'.format(10 + (i >> 24) % 200, (i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff,
+                                   1024 + i % 60000)
+
+
+def make_proxy_queue(size, rnd):
+    queue = ProxyQueue(recheck_policy=RecheckPolicy(300, min_interval=60, max_interval=3600))
+    t = int(time.time())
+    for i in range(size):
+        good = rnd.randint(1, 100)
+        p = ProxyInfo(make_addr(i), t - rnd.randint(1, 3600), good=good, bad=rnd.randint(0, 100),
+                      fail=0 if rnd.random() < 0.8 else rnd.randint(1, 3),
+                      anonymity=rnd.randint(0, 2), https=rnd.random() < 0.3, post=rnd.random() < 0.5,
+                      check_time=t - rnd.randint(0, 3600))
+        queue.add_proxy(p)
+    return queue
+
+
+def bench_queue(sizes=None, ops=100000, memory=True, seed=0):
+    res = []
+    for size in sizes or QUEUE_SIZES:
+        # all the proxies are expired at first, each case pops up to 2 * n of them from the same queue
+        n = min(ops, size // 4)
+        queue = make_proxy_queue(size, random.Random(seed))
+
+        def feed_back(queue, i):
+            proxy = queue.get_expired_proxy()
+            # the proxy is rescheduled after the check time as the manager does
+            proxy.check_time = int(time.time())
+            queue.feed_back(proxy, (True, 2) if i % 4 else False)
+
+        res.append(run_case('queue.feed_back', {'size': size}, queue, feed_back, n, memory=memory))
+
+        def get_expired_proxy(queue, i):
+            queue.get_expired_proxy()
+
+        res.append(run_case('queue.get_expired_proxy', {'size': size}, queue, get_expired_proxy, n,
+                            memory=memory))
+        del queue
+    return res
+
+
+def bench_query(size=100000, ops=200, memory=True, seed=0):
+    res = []
+    queue = make_proxy_queue(size, random.Random(seed))
+    for kwargs in QUERY_FILTERS:
+        for order in QUERY_ORDERS:
+            for count in QUERY_COUNTS:
+                params = dict(kwargs, size=size, order=order, count=count)
+
+                def get_proxies(state, i):
+                    ProxiesEndpoint.get_proxies(queue, count, detail=True, order=order, **kwargs)
+
+                res.append(run_case('manager.get_proxies', params, None, get_proxies, ops, memory=memory))
+    return res
+
+
+def make_page(size, layout, rnd):
+    addrs = [make_addr(rnd.randint(0, 1 << 30)).split(':') for i in range(size)]
+    if layout == 'table':
+        rows = ''.join('<tr><td>{}</td><td>{}</td><td>HTTP</td><td>China</td></tr>'.format(ip, port)
+                       for ip, port in addrs)
+        body = '<table><tr><th>IP</th><th>PORT</th></tr>{}</table>'.format(rows)
+    elif layout == 'text':
+        body = '<pre>{}</pre>'.format('\n'.join('{}:{}'.format(ip, port) for ip, port in addrs))
+    elif layout == 'noisy':
+        # decoy numbers, scripts and nested markup between the addresses
+        body = ''.join('<div class="row"><script>var v = "{}.{}";</script><span>{}</span><!-- {} -->'
+                       '<span>{}</span><em>{} ms, 1.0.0</em></div>'
+                       .format(rnd.randint(0, 999), rnd.randint(0, 999), ip, rnd.random(), port,
+                               rnd.randint(1, 9999))
+                       for ip, port in addrs)
+    else:
+        raise ValueError("Unknown page layout '{}'".format(layout))
+    return '<html><head><title>proxies</title></head><body>{}</body></html>'.format(body)
+
+
+def bench_extract(sizes=None, layouts=None, ops=20, memory=True, seed=0):
+    res = []
+    for size in sizes or PAGE_SIZES:
+        for layout in layouts or PAGE_LAYOUTS:
+            page = make_page(size, layout, random.Random(seed))
+
+            def extract(state, i):
+                extract_proxies(page)
+
+            res.append(run_case('extractor.extract_proxies', {'size': size, 'layout': layout, 'bytes': len(page)},
+                                None, extract, ops, memory=memory))
+    return res
+
+
+async def start_local_server(app, loop):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(1024)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.SockSite(runner, sock)
+    await site.start()
+    return runner, '127.0.0.1:{}'.format(sock.getsockname()[1])
+
+
+def make_proxy_app(loop):
+    """
+    A stand-in HTTP proxy which forwards absolute-form requests with a shared session.
+    """
+    app = web.Application(loop=loop)
+    session = aiohttp.ClientSession(loop=loop)
+
+    async def forward(request):
+        with async_timeout.timeout(30, loop=loop):
+            async with session.request(request.method, request.raw_path, data=await request.read()) as resp:
+                body = await resp.read()
+                return web.Response(status=resp.status, body=body, content_type=resp.content_type)
+
+    async def close_session(app):
+        await session.close()
+
+    app.router.add_route('*', '/{tail:.*}', forward)
+    app.on_cleanup.append(close_session)
+    return app
+
+
+async def _bench_checker(checks, concurrency, proxies, memory, loop):
+    runners = []
+    try:
+        runner, judge_addr = await start_local_server(make_judge_app(loop=loop), loop)
+        runners.append(runner)
+        proxy_addrs = []
+        for i in range(proxies):
+            runner, addr = await start_local_server(make_proxy_app(loop), loop)
+            runners.append(runner)
+            proxy_addrs.append(addr)
+        checker = HttpbinChecker(loop=loop, checker_timeout=30, origin_ip='127.0.0.1', pool_size=concurrency,
+                                 judge_urls=['http://' + judge_addr])
+        latencies = []
+        failed = 0
+        semaphore = asyncio.Semaphore(concurrency, loop=loop)
+
+        async def check(i):
+            nonlocal failed
+            async with semaphore:
+                t = loop.time()
+                res = await checker.check_proxy(proxy_addrs[i % len(proxy_addrs)])
+                latencies.append(loop.time() - t)
+                if not res:
+                    failed += 1
+
+        start_time = loop.time()
+        await asyncio.gather(*[check(i) for i in range(checks)], loop=loop)
+        total_time = loop.time() - start_time
+        res = summarize('checker.check_proxy', {'concurrency': concurrency, 'proxies': proxies}, latencies,
+                        total_time)
+        res['failed'] = failed
+        if memory:
+            # memory is traced in a separate run, which does not count in the latencies
+            tracemalloc.start()
+            try:
+                await asyncio.gather(*[check(i) for i in range(checks)], loop=loop)
+                res['peak_memory'] = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        await checker.close()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+    return res
+
+
+def bench_checker(checks=2000, concurrency=100, proxies=4, memory=True):
+    """
+    Check proxies through local stand-in proxies against a local judge, the whole stack runs in this process.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        res = loop.run_until_complete(_bench_checker(checks, concurrency, proxies, memory, loop))
+    finally:
+        loop.close()
+    log.info('checker.check_proxy: %.1f ops/sec', res['ops_per_sec'] or 0)
+    return [res]
+
+
+SUITES = {
+    'queue': bench_queue,
+    'query': bench_query,
+    'extract': bench_extract,
+    'checker': bench_checker,
+}
+
+
+def run_benchmarks(suites=None, quick=False, memory=True, seed=0):
+    results = []
+    for name in suites or list(SUITES):
+        if name not in SUITES:
+            raise ValueError("Unknown benchmark '{}'".format(name))
+        log.info("Run benchmark '%s'", name)
+        if name == 'queue':
+            results.extend(bench_queue(sizes=[10000] if quick else None, ops=10000 if quick else 100000,
+                                       memory=memory, seed=seed))
+        elif name == 'query':
+            results.extend(bench_query(size=10000 if quick else 100000, ops=20 if quick else 200,
+                                       memory=memory, seed=seed))
+        elif name == 'extract':
+            results.extend(bench_extract(sizes=[100, 1000] if quick else None, ops=5 if quick else 20,
+                                         memory=memory, seed=seed))
+        elif name == 'checker':
+            results.extend(bench_checker(checks=200 if quick else 2000, memory=memory))
+    return {'version': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': int(time.time()),
+            'seed': seed,
+            'results': results}
+
+
+def dump_results(report, fname=None):
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if fname:
+        with open(fname, 'w') as f:
+            f.write(text)
+            f.write('\n')
+    else:
+        print(text)
@@ -0,0 +1,58 @@
+# coding=utf-8
+
+import uuid
+import asyncio
+from collections import deque
+from itertools import islice
+
+
+class ChangeLog:
+    """
+    A bounded, sequence-numbered log of the changes of available proxies.
+
+    Only the membership and the labels of proxies are tracked, the statistics of checks change on every check and
+    should be fetched from the list of proxies.
+    """
+
+    def __init__(self, maxlen=10000, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        # sequence numbers are only meaningful within the log with the same ID
+        self.id = uuid.uuid4().hex
+        self.seq = 0
+        self._changes = deque(maxlen=maxlen)
+        self._waiter = None
+
+    def __len__(self):
+        return len(self._changes)
+
+    def append(self, op, proxy):
+        self.seq += 1
+        self._changes.append({'seq': self.seq, 'op': op, 'address': proxy.addr,
+                              'anonymity': proxy.anonymity, 'https': proxy.https, 'post': proxy.post})
+        if self._waiter is not None:
+            if not self._waiter.done():
+                self._waiter.set_result(None)
+            self._waiter = None
+
+    def get_changes(self, since):
+        """
+        Return the changes after the given sequence number, or None if some of them have been discarded.
+        """
+        if since > self.seq:
+            return None
+        if since == self.seq:
+            return []
+        first = self._changes[0]['seq'] if self._changes else self.seq + 1
+        if since < first - 1:
+            return None
+        return list(islice(self._changes, since - first + 1, None))
+
+    async def wait(self, since, timeout):
+        if self.seq != since:
+            return
+        if self._waiter is None:
+            self._waiter = self.loop.create_future()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._waiter, loop=self.loop), timeout, loop=self.loop)
+        except asyncio.TimeoutError:
+            pass
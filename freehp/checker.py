@@ -13,19 +13,43 @@ log = logging.getLogger(__name__)
 
 
 class HttpbinChecker:
-    HTTP_CHECK_URL = 'http://httpbin.org/get'
-    HTTPS_CHECK_URL = 'https://httpbin.org/get'
-    POST_CHECK_URL = 'http://httpbin.org/post'
+    JUDGE_URLS = ['http://httpbin.org']
+    HTTPS_JUDGE_URLS = ['https://httpbin.org']
 
-    def __init__(self, *, loop=None, checker_timeout=10, origin_ip=None):
+    def __init__(self, *, loop=None, checker_timeout=10, origin_ip=None, pool_size=100, dns_cache_ttl=300,
+                 judge_urls=None, https_judge_urls=None):
         self.loop = loop or asyncio.get_event_loop()
         self.timeout = float(checker_timeout)
         self.origin_ip = origin_ip
+        self.judge_urls = [i.rstrip('/') for i in judge_urls or self.JUDGE_URLS]
+        self.https_judge_urls = [i.rstrip('/') for i in https_judge_urls or self.HTTPS_JUDGE_URLS]
+        self.pool_size = pool_size
+        self.dns_cache_ttl = dns_cache_ttl
+        self._session = None
 
     @classmethod
     def from_manager(cls, manager):
         config = manager.config
-        return cls(loop=manager.loop, checker_timeout=config.get('checker_timeout'), origin_ip=config.get('origin_ip'))
+        pool_size = config.getint('checker_pool_size') or 2 * config.getint('checker_max_clients')
+        return cls(loop=manager.loop, checker_timeout=config.get('checker_timeout'), origin_ip=config.get('origin_ip'),
+                   pool_size=pool_size, dns_cache_ttl=config.getint('checker_dns_cache_ttl'),
+                   judge_urls=config.getlist('judge_urls'), https_judge_urls=config.getlist('https_judge_urls'))
+
+    async def open(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, use_dns_cache=True,
+                                             ttl_dns_cache=self.dns_cache_ttl, loop=self.loop)
+            self._session = aiohttp.ClientSession(connector=connector, loop=self.loop)
+
+    async def close(self):
+        if self._session is not None:
+            session, self._session = self._session, None
+            await session.close()
+
+    async def _get_session(self):
+        if self._session is None:
+            await self.open()
+        return self._session
 
     async def check_proxy(self, addr, https=False):
         anonymity = 0
@@ -34,20 +58,21 @@ class HttpbinChecker:
         else:
             proxy = addr
         try:
-            async with aiohttp.ClientSession(loop=self.loop) as session:
-                with async_timeout.timeout(self.timeout, loop=self.loop):
-                    seed = str(random.randint(0, 99999999))
-                    url = "{}?show_env=1&seed={}".format(self.HTTPS_CHECK_URL if https else self.HTTP_CHECK_URL, seed)
-                    async with session.get(url, proxy=proxy, headers={'Connection': 'keep-alive'}) as resp:
-                        body = await resp.read()
-                        data = json.loads(body.decode())
-                        if data['args'].get('seed') != seed:
-                            return False
-                        if self.origin_ip:
-                            if self.origin_ip not in data['origin']:
-                                anonymity = 1
-                            if self._is_elite_proxy(data):
-                                anonymity = 2
+            session = await self._get_session()
+            with async_timeout.timeout(self.timeout, loop=self.loop):
+                seed = str(random.randint(0, 99999999))
+                judge_url = random.choice(self.https_judge_urls if https else self.judge_urls)
+                url = "{}/get?show_env=1&seed={}".format(judge_url, seed)
+                async with session.get(url, proxy=proxy, headers={'Connection': 'keep-alive'}) as resp:
+                    body = await resp.read()
+                    data = json.loads(body.decode())
+                    if data['args'].get('seed') != seed:
+                        return False
+                    if self.origin_ip:
+                        if self.origin_ip not in data['origin']:
+                            anonymity = 1
+                        if self._is_elite_proxy(data):
+                            anonymity = 2
         except CancelledError:
             raise
         except Exception:
@@ -61,16 +86,17 @@ class HttpbinChecker:
         else:
             proxy = addr
         try:
-            async with aiohttp.ClientSession(loop=self.loop) as session:
-                with async_timeout.timeout(self.timeout, loop=self.loop):
-                    seed = str(random.randint(0, 99999999))
-                    form_data = aiohttp.FormData()
-                    form_data.add_field('seed', seed)
-                    async with session.post(self.POST_CHECK_URL, data=form_data, proxy=proxy) as resp:
-                        body = await resp.read()
-                        data = json.loads(body.decode())
-                        if data['form'].get('seed') != seed:
-                            return False
+            session = await self._get_session()
+            with async_timeout.timeout(self.timeout, loop=self.loop):
+                seed = str(random.randint(0, 99999999))
+                form_data = aiohttp.FormData()
+                form_data.add_field('seed', seed)
+                url = "{}/post".format(random.choice(self.judge_urls))
+                async with session.post(url, data=form_data, proxy=proxy) as resp:
+                    body = await resp.read()
+                    data = json.loads(body.decode())
+                    if data['form'].get('seed') != seed:
+                        return False
         except CancelledError:
             raise
         except Exception:
@@ -83,6 +109,6 @@ class HttpbinChecker:
             return False
         if 'Proxy-Connection' in data['headers']:
             return False
-        if ',' in data['headers']['Via']:
+        if ',' in data['headers'].get('Via', ''):
             return False
         return True
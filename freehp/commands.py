@@ -9,6 +9,8 @@ from freehp.version import __version__
 from freehp.manager import ProxyManager
 from freehp import config
 from freehp import squid
+from freehp import judge
+from freehp import bench
 
 log = logging.getLogger(__name__)
 
@@ -77,7 +79,8 @@ class RunCommand(Command):
     def _import_settings(self):
         return (config.Bind, config.Daemon, config.PidFile,
                 config.LogLevel, config.LogFile,
-                config.MinAnonymity, config.CheckerTimeout)
+                config.MinAnonymity, config.CheckerTimeout, config.CheckerWorkers, config.SnapshotFile, config.Judge,
+                config.ApiWorkers, config.ApiReusePort)
 
     def add_arguments(self, parser):
         parser.add_argument('-c', '--config', dest='config', metavar='FILE',
@@ -131,6 +134,8 @@ class SquidCommand(Command):
                 config.Daemon, config.MinAnonymity,
                 squid.MaxNumSetting, squid.HttpsSetting, squid.PostSetting,
                 squid.UpdateIntervalSetting, squid.TimeoutSetting, squid.OnceSetting,
+                squid.ReloadThresholdSetting, squid.MaxReloadIntervalSetting,
+                squid.PeerMaxWeightSetting, squid.PeerMaxConnSetting,
                 config.LogLevel, config.LogFile)
 
     def add_arguments(self, parser):
@@ -161,6 +166,112 @@ class SquidCommand(Command):
             log.error(e, exc_info=True)
 
 
+class JudgeBindSetting(config.Setting):
+    name = 'bind'
+    cli = ['-b', '--bind']
+    metavar = 'ADDRESS'
+    default = '0.0.0.0:6257'
+    short_desc = 'the socket to bind'
+
+
+class JudgeCommand(Command):
+    @property
+    def name(self):
+        return "judge"
+
+    @property
+    def syntax(self):
+        return "[OPTIONS]"
+
+    @property
+    def short_desc(self):
+        return "Run httpbin compatible judge server for checking proxies"
+
+    def _import_settings(self):
+        return (JudgeBindSetting, config.Daemon, config.LogLevel, config.LogFile)
+
+    def run(self, args):
+        cfg = config.Config()
+        cfg.update(self.config)
+        if cfg.getbool('daemon'):
+            utils.be_daemon()
+        utils.configure_logging('freehp', cfg)
+        try:
+            judge.run_judge(self.config.get('bind', JudgeBindSetting.default))
+        except Exception as e:
+            log.error(e, exc_info=True)
+
+
+class BenchSuiteSetting(config.Setting):
+    name = 'suite'
+    cli = ['--suite']
+    metavar = 'NAME'
+    action = 'append'
+    short_desc = 'benchmark suite to run, one of {}, can be repeated'.format(', '.join(bench.SUITES))
+
+
+class BenchQuickSetting(config.Setting):
+    name = 'quick'
+    cli = ['--quick']
+    action = 'store_true'
+    default = False
+    short_desc = 'run with small sizes for a quick check'
+
+
+class BenchNoMemorySetting(config.Setting):
+    name = 'no_memory'
+    cli = ['--no-memory']
+    action = 'store_true'
+    default = False
+    short_desc = 'skip measuring peak memory'
+
+
+class BenchSeedSetting(config.Setting):
+    name = 'seed'
+    cli = ['--seed']
+    metavar = 'INT'
+    type = int
+    default = 0
+    short_desc = 'seed of the generated data'
+
+
+class BenchOutputSetting(config.Setting):
+    name = 'output'
+    cli = ['-o', '--output']
+    metavar = 'FILE'
+    short_desc = 'write the JSON results to the file instead of stdout'
+
+
+class BenchCommand(Command):
+    @property
+    def name(self):
+        return "bench"
+
+    @property
+    def syntax(self):
+        return "[OPTIONS]"
+
+    @property
+    def short_desc(self):
+        return "Run benchmarks offline and report the results as JSON"
+
+    def _import_settings(self):
+        return (BenchSuiteSetting, BenchQuickSetting, BenchNoMemorySetting, BenchSeedSetting, BenchOutputSetting,
+                config.LogLevel, config.LogFile)
+
+    def run(self, args):
+        cfg = config.Config()
+        cfg.update(self.config)
+        utils.configure_logging('freehp', cfg)
+        try:
+            report = bench.run_benchmarks(suites=self.config.get('suite'), quick=self.config.getbool('quick'),
+                                          memory=not self.config.getbool('no_memory'),
+                                          seed=self.config.getint('seed', 0))
+        except ValueError as e:
+            raise UsageError(e)
+        bench.dump_results(report, self.config.get('output'))
+
+
 class VersionCommand(Command):
     @property
     def name(self):
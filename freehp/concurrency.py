@@ -0,0 +1,107 @@
+# coding=utf-8
+
+import asyncio
+
+
+class ConcurrencyController:
+    """
+    Limit the number of in-flight tasks, the limit is adjusted by AIMD according to the latency,
+    the timeout rate and the backlog.
+    """
+
+    def __init__(self, min_limit, max_limit, init_limit=None, *, increase_step=10, decrease_factor=0.75,
+                 latency_tolerance=2.0, timeout_tolerance=0.2, smoothing=0.05, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        if init_limit is None:
+            init_limit = min_limit
+        self.limit = min(max(init_limit, min_limit), max_limit)
+        self.in_flight = 0
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.timeout_tolerance = timeout_tolerance
+        self.smoothing = smoothing
+        self.base_latency = None
+        self.base_timeout_rate = None
+        self._waiters = []
+        self._reset_window()
+
+    async def acquire(self):
+        while self.in_flight >= self.limit:
+            f = self.loop.create_future()
+            self._waiters.append(f)
+            try:
+                await f
+            except asyncio.CancelledError:
+                if f in self._waiters:
+                    self._waiters.remove(f)
+                self._wakeup()
+                raise
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._wakeup()
+
+    def record(self, latency, ok, timeout=False):
+        self._count += 1
+        if ok:
+            self._ok_count += 1
+            self._latency_sum += latency
+        if timeout:
+            self._timeout_count += 1
+
+    def adjust(self, backlog):
+        old_limit = self.limit
+        if self._count > 0:
+            timeout_rate = self._timeout_count / self._count
+            latency = self._latency_sum / self._ok_count if self._ok_count > 0 else None
+            if self._is_congested(latency, timeout_rate):
+                self.limit = max(self.min_limit, int(self.limit * self.decrease_factor))
+            elif backlog > 0 and self.in_flight >= self.limit:
+                self.limit = min(self.max_limit, self.limit + self.increase_step)
+            self._update_baseline(latency, timeout_rate)
+        elif backlog > 0 and self.in_flight >= self.limit:
+            self.limit = min(self.max_limit, self.limit + self.increase_step)
+        if backlog == 0 and self.in_flight < self.limit // 2:
+            self.limit = max(self.min_limit, self.limit - self.increase_step)
+        self._reset_window()
+        if self.limit > old_limit:
+            self._wakeup()
+        return self.limit
+
+    def _is_congested(self, latency, timeout_rate):
+        if latency is not None and self.base_latency is not None \
+                and latency > self.base_latency * self.latency_tolerance:
+            return True
+        if self.base_timeout_rate is not None and timeout_rate > self.base_timeout_rate + self.timeout_tolerance:
+            return True
+        return False
+
+    def _update_baseline(self, latency, timeout_rate):
+        a = self.smoothing
+        if latency is not None:
+            if self.base_latency is None:
+                self.base_latency = latency
+            else:
+                self.base_latency = (1 - a) * self.base_latency + a * latency
+        if self.base_timeout_rate is None:
+            self.base_timeout_rate = timeout_rate
+        else:
+            self.base_timeout_rate = (1 - a) * self.base_timeout_rate + a * timeout_rate
+
+    def _reset_window(self):
+        self._count = 0
+        self._ok_count = 0
+        self._timeout_count = 0
+        self._latency_sum = 0.0
+
+    def _wakeup(self):
+        n = self.limit - self.in_flight
+        while n > 0 and self._waiters:
+            f = self._waiters.pop(0)
+            if not f.done():
+                f.set_result(None)
+                n -= 1
@@ -1,7 +1,7 @@
 # coding=utf-8
 
 import copy
-from collections import MutableMapping
+from collections.abc import MutableMapping
 import inspect
 
 
@@ -191,6 +191,64 @@ class Bind(Setting):
     short_desc = 'the socket to bind'
 
 
+class SnapshotFile(Setting):
+    name = 'snapshot_file'
+    cli = ['--snapshot-file']
+    metavar = 'FILE'
+    short_desc = 'where to save snapshots of the proxy pool for warm restarts'
+
+
+class SnapshotInterval(Setting):
+    name = 'snapshot_interval'
+    default = 60
+
+
+class ResponseCacheSize(Setting):
+    name = 'response_cache_size'
+    default = 128
+
+
+class ChangeLogSize(Setting):
+    name = 'change_log_size'
+    default = 10000
+
+
+class ChangePollTimeout(Setting):
+    name = 'change_poll_timeout'
+    default = 30
+
+
+class ApiWorkers(Setting):
+    name = 'api_workers'
+    cli = ['--api-workers']
+    metavar = 'INT'
+    default = 0
+    type = int
+    short_desc = 'number of API processes serving /proxies, 0 means serving in the manager process'
+
+
+class ApiReusePort(Setting):
+    name = 'api_reuse_port'
+    cli = ['--api-reuse-port']
+    action = 'store_true'
+    default = False
+    short_desc = 'let each API process bind the socket with SO_REUSEPORT'
+
+
+class ApiPoolFile(Setting):
+    name = 'api_pool_file'
+
+
+class ApiPublishInterval(Setting):
+    name = 'api_publish_interval'
+    default = 1
+
+
+class StatsBind(Setting):
+    name = 'stats_bind'
+    default = '127.0.0.1:6258'
+
+
 class BlockTime(Setting):
     name = 'block_time'
     default = 7200
@@ -229,16 +287,107 @@ class CheckerClients(Setting):
     default = 100
 
 
+class CheckerWorkers(Setting):
+    name = 'checker_workers'
+    cli = ['--checker-workers']
+    metavar = 'INT'
+    default = 0
+    type = int
+    short_desc = 'number of checker worker processes, 0 means checking in the manager process'
+
+
+class OriginIpUrl(Setting):
+    name = 'origin_ip_url'
+    default = 'http://httpbin.org/get'
+
+
+class JudgeUrls(Setting):
+    name = 'judge_urls'
+
+
+class HttpsJudgeUrls(Setting):
+    name = 'https_judge_urls'
+
+
+class Judge(Setting):
+    name = 'judge'
+    cli = ['--judge']
+    action = 'store_true'
+    default = False
+    short_desc = 'serve httpbin compatible judge routes under /judge'
+
+
+class CheckerPoolSize(Setting):
+    # the connection limit of the checker, defaults to twice the checker_max_clients
+    # since a label check probes HTTPS and POST at the same time
+    name = 'checker_pool_size'
+
+
+class CheckerDnsCacheTtl(Setting):
+    name = 'checker_dns_cache_ttl'
+    default = 300
+
+
+class CheckerMinClients(Setting):
+    name = 'checker_min_clients'
+    default = 10
+
+
+class CheckerMaxClients(Setting):
+    name = 'checker_max_clients'
+    default = 500
+
+
+class CheckerAdjustInterval(Setting):
+    name = 'checker_adjust_interval'
+    default = 2
+
+
+class ScreenClients(Setting):
+    name = 'screen_clients'
+    default = 1000
+
+
+class ScreenTimeout(Setting):
+    name = 'screen_timeout'
+    default = 3
+
+
 class CheckInterval(Setting):
     name = 'check_interval'
     default = 300
 
 
+class MinCheckInterval(Setting):
+    name = 'min_check_interval'
+    default = 60
+
+
+class MaxCheckInterval(Setting):
+    name = 'max_check_interval'
+    default = 3600
+
+
+class LabelInterval(Setting):
+    name = 'label_interval'
+    default = 1800
+
+
 class ScrapInterval(Setting):
     name = 'scrap_interval'
     default = 300
 
 
+class MinScrapInterval(Setting):
+    name = 'min_scrap_interval'
+    default = 60
+
+
+class MaxScrapInterval(Setting):
+    name = 'max_scrap_interval'
+    default = 3600
+
+
 class SpiderTimeout(Setting):
     name = 'spider_timeout'
     default = 30
@@ -249,6 +398,44 @@ class SpiderSleepTime(Setting):
     default = 5
 
 
+class SpiderConcurrency(Setting):
+    name = 'spider_concurrency'
+    default = 2
+
+
+class SpiderRateLimit(Setting):
+    # requests per second to each host, defaults to 1 / spider_sleep_time
+    name = 'spider_rate_limit'
+
+
+class SpiderRetryTimes(Setting):
+    name = 'spider_retry_times'
+    default = 3
+
+
+class SpiderBackoffBase(Setting):
+    name = 'spider_backoff_base'
+    default = 2
+
+
+class SpiderBackoffMax(Setting):
+    name = 'spider_backoff_max'
+    default = 60
+
+
+class SpiderExtractor(Setting):
+    name = 'spider_extractor'
+
+
+class SpiderExtractorWorkers(Setting):
+    name = 'spider_extractor_workers'
+
+
+class SpiderExtractorBatchSize(Setting):
+    name = 'spider_extractor_batch_size'
+    default = 65536
+
+
 class SpiderHeaders(Setting):
     name = 'spider_headers'
     default = {
@@ -4,46 +4,119 @@ import re
 
 from lxml import etree
 
-ip_reg = re.compile(r'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}|\d{2,5})')
+_token_reg = re.compile(r'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})|(\d{2,5})')
+_valid_ip_reg = re.compile(r'(?!0{1,3}\.)(?:25[0-5]|2[0-4]\d|[01]?\d?\d)(?:\.(?:25[0-5]|2[0-4]\d|[01]?\d?\d)){3}$')
 
+MAX_TEXT_BUFFER = 65536
+MAX_PENDING_MARKUP = 65536
 
-def is_ip(t):
-    first = True
-    for i in t.split('.'):
-        if first:
-            if int(i) == 0:
-                return False
-            first = False
-        if int(i) > 255:
-            return False
-    return True
 
+class ProxyExtractor:
+    """
+    Extract proxies from the text in HTML body incrementally.
+    """
 
-def is_port(t):
-    t = int(t)
-    # TODO HTTPS 443
-    if t == 80:
-        return True
-    if 1024 < t < 65536:
-        return True
-    return False
+    def __init__(self):
+        self._proxies = []
+        self._pre_ip = None
+        self._parser = etree.HTMLParser(target=_BodyTextTarget(self._scan))
+        self._pending = ''
+        # libxml2 push parser stops if the document starts with an end tag
+        self._parser.feed('<html>')
+
+    def feed(self, data):
+        # only feed complete markup to the parser, libxml2 does not always handle tags split across chunks
+        data = self._pending + data
+        i = data.rfind('<')
+        # a stray '<' in the text may never be closed
+        if i < 0 or i < data.rfind('>') or len(data) - i > MAX_PENDING_MARKUP:
+            i = len(data)
+        self._pending = data[i:]
+        if i > 0:
+            self._parser.feed(data[:i])
+
+    def close(self):
+        try:
+            if self._pending:
+                self._parser.feed(self._pending)
+                self._pending = ''
+            self._parser.close()
+        except etree.LxmlError:
+            pass
+        return self._proxies
+
+    def _scan(self, text):
+        for ip, port in _token_reg.findall(text):
+            if ip:
+                self._pre_ip = ip if _valid_ip_reg.match(ip) else None
+            elif self._pre_ip:
+                p = int(port)
+                if p == 80 or 1024 < p < 65536:
+                    self._proxies.append(self._pre_ip + ':' + port)
+
+
+class _BodyTextTarget:
+    def __init__(self, callback):
+        self._callback = callback
+        self._in_body = False
+        self._buffer = []
+        self._buffer_size = 0
+
+    def start(self, tag, attrib):
+        if tag == 'body':
+            # libxml2 keeps the content after '</body>' in the body as well
+            self._in_body = True
+        # text nodes are separated by blanks, so that a token never crosses the boundary of nodes
+        if self._buffer:
+            self._buffer.append(' ')
+
+    def end(self, tag):
+        if self._buffer:
+            self._buffer.append(' ')
+
+    def comment(self, text):
+        if self._buffer:
+            self._buffer.append(' ')
+
+    def data(self, data):
+        if self._in_body:
+            self._buffer.append(data)
+            self._buffer_size += len(data)
+            if self._buffer_size > MAX_TEXT_BUFFER:
+                self._flush()
+
+    def close(self):
+        self._flush(final=True)
+
+    def _flush(self, final=False):
+        if not self._buffer:
+            return
+        text = ''.join(self._buffer)
+        self._buffer = []
+        self._buffer_size = 0
+        if not final:
+            # keep the trailing digits and dots which may be a part of the next token
+            i = len(text.rstrip('0123456789.'))
+            if i < len(text):
+                self._buffer.append(text[i:])
+                self._buffer_size = len(text) - i
+            text = text[:i]
+        self._callback(text)
 
 
 def extract_proxies(html):
+    extractor = ProxyExtractor()
     try:
-        root = etree.fromstring(html, parser=etree.HTMLParser())
-        s = root.xpath('//body', smart_strings=False)
-        text = ''
-        for i in s:
-            text += ' '.join(i.itertext())
+        extractor.feed(html)
     except Exception:
         return []
+    return extractor.close()
+
+
+def extract_proxies_batch(pages):
     res = []
-    pre_ip = None
-    for i in ip_reg.findall(text):
-        if i.find('.') >= 0:
-            pre_ip = i
-        else:
-            if pre_ip and is_ip(pre_ip) and is_port(i):
-                res.append(pre_ip + ':' + i)
+    for p in pages:
+        if isinstance(p, bytes):
+            p = p.decode('utf-8', errors='ignore')
+        res.append(extract_proxies(p))
     return res
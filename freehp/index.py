@@ -0,0 +1,68 @@
+# coding=utf-8
+
+from bisect import bisect_left, insort
+
+DEFAULT_LOAD = 512
+
+
+class SortedIndex:
+    """
+    Keep items ordered by ascending keys, ties are broken by insertion order.
+
+    Entries are kept in a list of sorted buckets with at most ``2 * load`` entries each, thus adding or discarding
+    an item only moves the entries of one bucket rather than the whole index.
+    """
+
+    def __init__(self, load=DEFAULT_LOAD):
+        self._load = load
+        self._buckets = []
+        # the last entry of each bucket
+        self._maxes = []
+        self._item_keys = {}
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._item_keys)
+
+    def __contains__(self, item):
+        return item in self._item_keys
+
+    def __iter__(self):
+        for b in self._buckets:
+            for e in b:
+                yield e[2]
+
+    def add(self, item, key):
+        self.discard(item)
+        self._seq += 1
+        k = (key, self._seq)
+        self._item_keys[item] = k
+        e = (key, self._seq, item)
+        if not self._buckets:
+            self._buckets.append([e])
+            self._maxes.append(e)
+            return
+        i = bisect_left(self._maxes, e)
+        if i == len(self._maxes):
+            i -= 1
+        b = self._buckets[i]
+        insort(b, e)
+        self._maxes[i] = b[-1]
+        if len(b) > 2 * self._load:
+            half = b[self._load:]
+            del b[self._load:]
+            self._buckets.insert(i + 1, half)
+            self._maxes[i] = b[-1]
+            self._maxes.insert(i + 1, half[-1])
+
+    def discard(self, item):
+        k = self._item_keys.pop(item, None)
+        if k is not None:
+            i = bisect_left(self._maxes, k)
+            b = self._buckets[i]
+            del b[bisect_left(b, k)]
+            if b:
+                self._maxes[i] = b[-1]
+            else:
+                del self._buckets[i]
+                del self._maxes[i]
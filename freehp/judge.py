@@ -0,0 +1,50 @@
+# coding=utf-8
+
+import logging
+
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+JUDGE_VIA = '1.1 freehp'
+
+
+def add_judge_routes(app, prefix=''):
+    """
+    Add httpbin compatible routes for checking proxies.
+    """
+    app.router.add_route('GET', prefix + '/get', echo)
+    app.router.add_route('POST', prefix + '/post', echo)
+
+
+def make_judge_app(loop=None):
+    app = web.Application(logger=log, loop=loop)
+    add_judge_routes(app)
+    return app
+
+
+async def echo(request):
+    headers = {}
+    for k, v in request.headers.items():
+        headers['-'.join(i.capitalize() for i in k.split('-'))] = v
+    # add our own hop as the front proxy of httpbin does, thus a comma in 'Via' still means a proxy in the middle
+    via = headers.get('Via')
+    headers['Via'] = '{}, {}'.format(via, JUDGE_VIA) if via else JUDGE_VIA
+    origin = [i.strip() for i in request.headers.get('X-Forwarded-For', '').split(',') if i.strip()]
+    peer = request.transport.get_extra_info('peername') if request.transport else None
+    if peer:
+        origin.append(peer[0])
+    data = {'args': dict(request.rel_url.query),
+            'headers': headers,
+            'origin': ', '.join(origin),
+            'url': str(request.url)}
+    if request.method == 'POST':
+        form = await request.post()
+        data['form'] = {k: v for k, v in form.items() if isinstance(v, str)}
+    return web.json_response(data)
+
+
+def run_judge(bind):
+    host, port = bind.split(':')
+    log.info("Bind to '%s'", bind)
+    web.run_app(make_judge_app(), host=host, port=int(port), access_log=None, print=None)
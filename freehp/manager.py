@@ -1,21 +1,41 @@
 # coding=utf-8
 
-import json
+import os
 import time
+import socket
 import asyncio
+import tempfile
+import multiprocessing
 import logging
 from asyncio.queues import Queue
-from collections import deque
+import heapq
 import signal
+from itertools import chain
+from os.path import isfile
 from asyncio import CancelledError
 
 from aiohttp import web
+import async_timeout
 
 from freehp.spider import ProxySpider
-from freehp.utils import load_object, get_origin_ip
+from freehp.index import SortedIndex
+from freehp.concurrency import ConcurrencyController
+from freehp.changes import ChangeLog
+from freehp.workers import CheckerWorkerPool
+from freehp.metrics import Registry, Gauge, Histogram
+from freehp.judge import add_judge_routes
+from freehp.api import ProxiesEndpoint, get_pool_records, publish_pool, run_api_server
+from freehp.snapshot import dump_snapshot, load_snapshot
+from freehp.utils import load_object, get_origin_ip, pack_addr, unpack_addr
 
 log = logging.getLogger(__name__)
 
+HISTORY_SIZE = 16
+HISTORY_MASK = (1 << HISTORY_SIZE) - 1
+
+REMOVE_BATCH_SIZE = 1000
+PUBLISH_COST_RATIO = 50
+
 
 class ProxyManager:
     def __init__(self, config):
@@ -27,23 +47,60 @@ class ProxyManager:
             asyncio.set_event_loop(self.loop)
 
         if not self.config.get('origin_ip'):
-            origin_ip = self.loop.run_until_complete(get_origin_ip(self.loop))
+            origin_ip = self.loop.run_until_complete(get_origin_ip(self.loop, url=self.config.get('origin_ip_url')))
             if not origin_ip:
                 raise RuntimeError('Failed to get origin IP address')
             self.config.set('origin_ip', origin_ip)
         log.info('Origin IP address: %s', self.config['origin_ip'])
 
-        self._checker = self._load_checker(config.get('checker'))
+        if config.getint('checker_workers') > 0:
+            self._checker = CheckerWorkerPool.from_manager(self)
+        else:
+            self._checker = self._load_checker(config.get('checker'))
         self._check_interval = self.config.get('check_interval')
+        self._label_interval = self.config.getint('label_interval')
+        self._checker_timeout = self.config.getfloat('checker_timeout')
+        self._concurrency = ConcurrencyController(config.getint('checker_min_clients'),
+                                                  config.getint('checker_max_clients'),
+                                                  config.getint('checker_clients'),
+                                                  loop=self.loop)
+        self._adjust_interval = config.getfloat('checker_adjust_interval')
+        self._screen_clients = config.getint('screen_clients')
+        self._screen_timeout = config.getfloat('screen_timeout')
+        # passed and failed counts of each stage
+        self._stage_stats = {'screen': [0, 0], 'http': [0, 0]}
         self._block_time = config.getint("block_time")
+        self._change_log = ChangeLog(config.getint('change_log_size'), loop=self.loop)
+        self._change_poll_timeout = config.getfloat('change_poll_timeout')
         self._proxy_queue = ProxyQueue(max_fail_times=config.getint("max_fail_times"),
-                                       min_anonymity=config.getint('min_anonymity'))
+                                       min_anonymity=config.getint('min_anonymity'),
+                                       recheck_policy=RecheckPolicy(self._check_interval,
+                                                                    min_interval=config.getint('min_check_interval'),
+                                                                    max_interval=config.getint('max_check_interval')),
+                                       change_log=self._change_log)
+        self._init_metrics()
         self._spider = ProxySpider.from_manager(self)
         self._spider.subscribe(self._add_proxy)
 
         self._proxy_db = {}
-
+        # expiry ordered keys of proxy DB
+        self._block_heap = []
+        self._max_fail_times = config.getint("max_fail_times")
+        self._snapshot_file = config.get('snapshot_file')
+        self._snapshot_interval = config.getfloat('snapshot_interval')
+        self._proxies_endpoint = ProxiesEndpoint(config.getint('response_cache_size'))
+        self._api_workers = config.getint('api_workers')
+        if self._api_workers > 0 and not config.get('api_pool_file'):
+            shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            config.set('api_pool_file', os.path.join(shm_dir, 'freehp-pool-{}.bin'.format(os.getpid())))
+        self._api_pool_file = config.get('api_pool_file')
+        self._api_publish_interval = config.getfloat('api_publish_interval')
+        self._api_processes = []
+        self._api_socket = None
+
+        self._screen_queue = Queue(loop=self.loop)
         self._wait_queue = Queue(loop=self.loop)
+        self._expire_event = asyncio.Event(loop=self.loop)
         self._label_queue = Queue(loop=self.loop)
         self._futures = None
         self._futures_done = None
@@ -51,10 +108,31 @@ class ProxyManager:
         self._check_futures_done = None
         self._label_futures = None
         self._label_futures_done = None
+        self._running_futures = set()
         self._app_runner = None
         self._tcp_site = None
         self._is_running = False
 
+    def _init_metrics(self):
+        self.metrics = Registry()
+        self._check_duration = Histogram('freehp_check_duration_seconds', 'Duration of checking proxies',
+                                         ['kind', 'result'], registry=self.metrics)
+        Gauge('freehp_queue_size', 'Number of proxies waiting in queues', ['queue'], registry=self.metrics,
+              callback=lambda: {'screen': self._screen_queue.qsize(), 'wait': self._wait_queue.qsize(),
+                                'label': self._label_queue.qsize()})
+        Gauge('freehp_proxies', 'Number of available proxies by anonymity level', ['anonymity'],
+              registry=self.metrics, callback=self._proxy_queue.count_by_anonymity)
+        Gauge('freehp_checker_clients', 'Limit of concurrent checks', registry=self.metrics,
+              callback=lambda: self._concurrency.limit)
+        Gauge('freehp_running_checkers', 'Number of running checks', registry=self.metrics,
+              callback=lambda: self._concurrency.in_flight)
+        Gauge('freehp_proxy_db_size', 'Number of known proxies', registry=self.metrics,
+              callback=lambda: len(self._proxy_db))
+        self._request_duration = Histogram('freehp_request_duration_seconds', 'Duration of serving API requests',
+                                           ['path'], registry=self.metrics)
+        self._event_loop_lag = Histogram('freehp_event_loop_lag_seconds', 'Lag of the event loop',
+                                         registry=self.metrics)
+
     def start(self):
         if not self._is_running:
             self._is_running = True
@@ -65,6 +143,9 @@ class ProxyManager:
             self._label_futures = []
             self._label_futures_done = set()
             self._init_server()
+            if hasattr(self._checker, 'open'):
+                self.loop.run_until_complete(self._checker.open())
+            self._restore_snapshot()
             self._init_checker()
             self._spider.open()
             f = asyncio.ensure_future(self._supervisor(), loop=self.loop)
@@ -110,20 +191,39 @@ class ProxyManager:
                 cancelled_futures.append(f)
             self._label_futures = None
             self._label_futures_done = None
+        for f in list(self._running_futures):
+            f.cancel()
+            cancelled_futures.append(f)
         await self._tcp_site.stop()
         self._tcp_site = None
         await self._app_runner.cleanup()
         self._app_runner = None
+        if self._api_workers > 0:
+            await self._stop_api_servers()
         await asyncio.wait(cancelled_futures, loop=self.loop)
+        await self._spider.cleanup()
+        if self._snapshot_file:
+            await self._save_snapshot()
+        if hasattr(self._checker, 'close'):
+            await self._checker.close()
         self.loop.stop()
         self.loop.remove_signal_handler(signal.SIGINT)
         self.loop.remove_signal_handler(signal.SIGTERM)
 
     def _init_server(self):
-        bind = self.config.get('bind')
+        if self._api_workers > 0:
+            self._init_api_servers()
+            bind = self.config.get('stats_bind')
+        else:
+            bind = self.config.get('bind')
         log.info("Bind to '%s'", bind)
         app = web.Application(logger=log, loop=self.loop)
         app.router.add_route("GET", "/proxies", self.get_proxies)
+        app.router.add_route("GET", "/changes", self.get_changes)
+        app.router.add_route("GET", "/stats", self.get_stats)
+        app.router.add_route("GET", "/metrics", self.get_metrics)
+        if self.config.getbool('judge'):
+            add_judge_routes(app, prefix='/judge')
         host, port = bind.split(":")
         port = int(port)
         self._app_runner = web.AppRunner(app, access_log=None)
@@ -131,34 +231,106 @@ class ProxyManager:
         self._tcp_site = web.TCPSite(self._app_runner, host=host, port=port)
         self.loop.run_until_complete(self._tcp_site.start())
 
-    async def _add_proxy(self, proxies):
+    def _init_api_servers(self):
+        bind = self.config.get('bind')
+        log.info("Start %s API processes, bind to '%s'", self._api_workers, bind)
+        publish_pool(self._api_pool_file, *get_pool_records(self._proxy_queue))
+        if not self.config.getbool('api_reuse_port'):
+            host, port = bind.split(':')
+            self._api_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._api_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._api_socket.bind((host, int(port)))
+            self._api_socket.listen(1024)
+        ctx = multiprocessing.get_context('spawn')
+        for i in range(self._api_workers):
+            p = ctx.Process(target=run_api_server, args=(self.config, self._api_socket), daemon=True)
+            p.start()
+            self._api_processes.append(p)
+
+    async def _publish_pool_task(self):
+        generation = None
+        delay = self._api_publish_interval
+        while True:
+            await asyncio.sleep(delay, loop=self.loop)
+            if self._proxy_queue.generation != generation:
+                generation = self._proxy_queue.generation
+                try:
+                    start_time = self.loop.time()
+                    records = get_pool_records(self._proxy_queue)
+                    # copying the pool blocks the event loop, keep it to a small share of the time for large pools
+                    delay = max(self._api_publish_interval, (self.loop.time() - start_time) * PUBLISH_COST_RATIO)
+                    await self.loop.run_in_executor(None, publish_pool, self._api_pool_file, *records)
+                except CancelledError:
+                    raise
+                except Exception:
+                    log.warning("Failed to publish the pool to '%s'", self._api_pool_file, exc_info=True)
+
+    async def _stop_api_servers(self):
+        for p in self._api_processes:
+            p.terminate()
+        for p in self._api_processes:
+            await self.loop.run_in_executor(None, p.join, 5)
+            if p.is_alive():
+                p.kill()
+        self._api_processes = []
+        if self._api_socket is not None:
+            self._api_socket.close()
+            self._api_socket = None
+        if isfile(self._api_pool_file):
+            os.remove(self._api_pool_file)
+
+    async def _add_proxy(self, proxies, source=None):
         t = int(time.time())
+        new = 0
         for p in proxies:
             try:
-                proxy = self._proxy_db.get(p)
+                key = pack_addr(p)
+                proxy = self._proxy_db.get(key)
                 if proxy and t - proxy.timestamp <= self._block_time:
                     continue
-                proxy = ProxyInfo(p, t)
-                self._proxy_db[p] = proxy
-                await self._wait_queue.put(proxy)
+                if proxy is None:
+                    heapq.heappush(self._block_heap, (t + self._block_time, key))
+                proxy = ProxyInfo(key, t, source=source)
+                self._proxy_db[key] = proxy
+                new += 1
+                if self._screen_clients > 0:
+                    await self._screen_queue.put(proxy)
+                else:
+                    await self._wait_queue.put(proxy)
             except CancelledError:
                 raise
             except Exception:
                 log.warning("Failed to add proxy '%s'", p, exc_info=True)
+        return new
 
     def _init_checker(self):
-        checker_clients = self.config.getint('checker_clients')
-        log.info("Initialize checker, clients=%s", checker_clients)
+        log.info("Initialize checker, clients=%s, min_clients=%s, max_clients=%s",
+                 self._concurrency.limit, self._concurrency.min_limit, self._concurrency.max_limit)
         f = asyncio.ensure_future(self._find_expired_proxy_task(), loop=self.loop)
         self._futures.append(f)
-        for i in range(checker_clients):
-            f = asyncio.ensure_future(self._check_proxy_task(), loop=self.loop)
+        if self._screen_clients > 0:
+            f = asyncio.ensure_future(self._dispatch_task(self._screen_queue, self._screen_proxy,
+                                                          asyncio.Semaphore(self._screen_clients, loop=self.loop)),
+                                      loop=self.loop)
             self._check_futures.append(f)
-        for i in range(checker_clients):
-            f = asyncio.ensure_future(self._label_proxy_task(), loop=self.loop)
-            self._label_futures.append(f)
+        f = asyncio.ensure_future(self._dispatch_task(self._wait_queue, self._check_proxy, self._concurrency),
+                                  loop=self.loop)
+        self._check_futures.append(f)
+        f = asyncio.ensure_future(self._dispatch_task(self._label_queue, self._label_proxy, self._concurrency),
+                                  loop=self.loop)
+        self._label_futures.append(f)
+        f = asyncio.ensure_future(self._adjust_concurrency_task(), loop=self.loop)
+        self._futures.append(f)
+        f = asyncio.ensure_future(self._event_loop_lag_task(), loop=self.loop)
+        self._futures.append(f)
         f = asyncio.ensure_future(self._remove_blocked_proxy_task(), loop=self.loop)
         self._futures.append(f)
+        if self._snapshot_file:
+            f = asyncio.ensure_future(self._snapshot_task(), loop=self.loop)
+            self._futures.append(f)
+        if self._api_workers > 0:
+            f = asyncio.ensure_future(self._publish_pool_task(), loop=self.loop)
+            self._futures.append(f)
 
     def _load_checker(self, cls_path):
         checker_cls = load_object(cls_path)
@@ -170,43 +342,205 @@ class ProxyManager:
 
     async def _find_expired_proxy_task(self):
         while True:
-            proxy = self._proxy_queue.get_expired_proxy()
-            if proxy is not None:
+            self._expire_event.clear()
+            for proxy in self._proxy_queue.get_expired_proxies():
                 await self._wait_queue.put(proxy)
+            t = self._proxy_queue.next_timestamp()
+            if t is None:
+                timeout = None
             else:
-                await asyncio.sleep(5, loop=self.loop)
+                # proxies are expired once the current time passes their timestamps
+                timeout = max(t + 1 - time.time(), 0)
+            try:
+                with async_timeout.timeout(timeout, loop=self.loop):
+                    await self._expire_event.wait()
+            except asyncio.TimeoutError:
+                pass
+
+    def _notify_expiry(self, proxy):
+        if self._proxy_queue.next_timestamp() == proxy.timestamp:
+            self._expire_event.set()
 
-    async def _check_proxy_task(self):
+    async def _dispatch_task(self, queue, handler, limiter):
         while True:
-            proxy = await self._wait_queue.get()
-            res = await self._checker.check_proxy(proxy.addr)
-            t = int(time.time())
-            proxy.timestamp = t + self._check_interval
-            self._proxy_queue.feed_back(proxy, res)
-            if res:
-                await self._label_queue.put(proxy)
+            item = await queue.get()
+            await limiter.acquire()
+            f = asyncio.ensure_future(self._run_handler(handler, item, limiter), loop=self.loop)
+            self._running_futures.add(f)
+            f.add_done_callback(self._running_futures.discard)
 
-    async def _remove_blocked_proxy_task(self):
+    async def _run_handler(self, handler, item, limiter):
+        try:
+            await handler(item)
+        except CancelledError:
+            raise
+        except Exception:
+            log.warning("Unexpected error occurred when handle %s", item, exc_info=True)
+        finally:
+            limiter.release()
+
+    async def _screen_proxy(self, proxy):
+        host, port = proxy.addr.split(':')
+        start_time = self.loop.time()
+        ok = False
+        try:
+            with async_timeout.timeout(self._screen_timeout, loop=self.loop):
+                reader, writer = await asyncio.open_connection(host, int(port), loop=self.loop)
+            writer.close()
+            ok = True
+        except CancelledError:
+            raise
+        except Exception:
+            pass
+        self._observe_check('screen', ok, self.loop.time() - start_time)
+        if ok:
+            await self._wait_queue.put(proxy)
+
+    def _observe_check(self, kind, ok, duration):
+        result = 'success' if ok else 'failure'
+        self._check_duration.labels(kind, result).observe(duration)
+        stats = self._stage_stats.get(kind)
+        if stats is not None:
+            if ok:
+                stats[0] += 1
+            else:
+                stats[1] += 1
+
+    async def _timed_check(self, kind, coro):
+        start_time = self.loop.time()
+        res = await coro
+        self._observe_check(kind, bool(res), self.loop.time() - start_time)
+        return res
+
+    async def _event_loop_lag_task(self):
         while True:
-            await asyncio.sleep(self._block_time, loop=self.loop)
-            t = time.time()
-            for i in list(self._proxy_db.keys()):
-                if t - self._proxy_db[i].timestamp > self._block_time:
-                    del self._proxy_db[i]
+            t = self.loop.time()
+            await asyncio.sleep(1, loop=self.loop)
+            self._event_loop_lag.observe(max(self.loop.time() - t - 1, 0))
+
+    async def _adjust_concurrency_task(self):
+        while True:
+            await asyncio.sleep(self._adjust_interval, loop=self.loop)
+            old_limit = self._concurrency.limit
+            limit = self._concurrency.adjust(self._wait_queue.qsize() + self._label_queue.qsize())
+            if limit != old_limit:
+                log.debug("Adjust checker clients: %s -> %s", old_limit, limit)
+
+    @property
+    def checker_concurrency(self):
+        return self._concurrency.limit
+
+    async def _check_proxy(self, proxy):
+        start_time = self.loop.time()
+        res = await self._checker.check_proxy(proxy.addr)
+        latency = self.loop.time() - start_time
+        self._concurrency.record(latency, bool(res), timeout=not res and latency >= self._checker_timeout)
+        self._observe_check('http', bool(res), latency)
+        t = int(time.time())
+        proxy.check_time = t
+        if res:
+            # smoothed latency of successful checks
+            proxy.latency = latency if proxy.latency is None else 0.7 * proxy.latency + 0.3 * latency
+        self._proxy_queue.feed_back(proxy, res)
+        self._notify_expiry(proxy)
+        if proxy.good == 1 and proxy.fail == 0 and proxy.source is not None:
+            self._spider.record_passed(proxy.source)
+        if res and t - proxy.label_time >= self._label_interval:
+            await self._label_queue.put(proxy)
 
-    async def _label_proxy_task(self):
+    async def _remove_blocked_proxy_task(self):
         while True:
-            proxy = await self._label_queue.get()
             t = time.time()
-            if t > proxy.timestamp:
-                continue
-            https = await self._checker.check_proxy(proxy.addr, https=True)
-            if https and https[1] > 0:
-                proxy.https = True
+            while not self._remove_blocked_proxies(t):
+                await asyncio.sleep(0, loop=self.loop)
+                t = time.time()
+            if len(self._block_heap) > 0:
+                delay = max(self._block_heap[0][0] - t, 1)
             else:
-                proxy.https = False
-            post = await self._checker.verify_post(proxy.addr)
-            proxy.post = post
+                delay = self._block_time
+            await asyncio.sleep(delay, loop=self.loop)
+
+    def _remove_blocked_proxies(self, t, batch_size=REMOVE_BATCH_SIZE):
+        """
+        Remove the proxies blocked until before ``t``, return False if the batch is full before all of them are done.
+        """
+        n = 0
+        while len(self._block_heap) > 0 and self._block_heap[0][0] < t:
+            if n >= batch_size:
+                return False
+            key = heapq.heappop(self._block_heap)[1]
+            proxy = self._proxy_db.get(key)
+            if proxy is not None:
+                # the timestamp may have been updated since the key was pushed
+                expire_at = proxy.timestamp + self._block_time
+                if expire_at < t:
+                    del self._proxy_db[key]
+                else:
+                    heapq.heappush(self._block_heap, (expire_at, key))
+            n += 1
+        return True
+
+    def _restore_snapshot(self):
+        if not self._snapshot_file or not isfile(self._snapshot_file):
+            return
+        try:
+            records = load_snapshot(self._snapshot_file)
+        except Exception:
+            log.warning("Failed to load snapshot '%s'", self._snapshot_file, exc_info=True)
+            return
+        t = int(time.time())
+        proxies = []
+        for r in records:
+            try:
+                kwargs = dict(r)
+                proxy = ProxyInfo(kwargs.pop('addr'), kwargs.pop('timestamp'), **kwargs)
+            except Exception:
+                log.warning("Failed to restore proxy from record %s", r, exc_info=True)
+                continue
+            # block the restored proxies from now on as newly scraped ones,
+            # otherwise they may expire from DB while still waiting to be verified after a long downtime
+            proxy.timestamp = t
+            if proxy.key not in self._proxy_db:
+                heapq.heappush(self._block_heap, (proxy.timestamp + self._block_time, proxy.key))
+            self._proxy_db[proxy.key] = proxy
+            if proxy.fail <= self._max_fail_times:
+                proxies.append(proxy)
+        # verify the proxies which were available before at first
+        proxies.sort(key=lambda p: (p.fail, -p.rate))
+        for p in proxies:
+            self._wait_queue.put_nowait(p)
+        log.info("Restore %s proxies from snapshot '%s', %s proxies to be verified",
+                 len(records), self._snapshot_file, len(proxies))
+
+    async def _snapshot_task(self):
+        while True:
+            await asyncio.sleep(self._snapshot_interval, loop=self.loop)
+            await self._save_snapshot()
+
+    async def _save_snapshot(self):
+        records = [[p.addr, p.timestamp, p.good, p.bad, p.fail, p.anonymity, p.https, p.post,
+                    p.check_time, p.label_time, p.history, p.source, p.latency]
+                   for p in self._proxy_db.values()]
+        try:
+            await self.loop.run_in_executor(None, dump_snapshot, self._snapshot_file, records)
+        except CancelledError:
+            raise
+        except Exception:
+            log.warning("Failed to save snapshot '%s'", self._snapshot_file, exc_info=True)
+        else:
+            log.debug("Save %s proxies to snapshot '%s'", len(records), self._snapshot_file)
+
+    async def _label_proxy(self, proxy):
+        t = time.time()
+        if t > proxy.timestamp:
+            return
+        # POST probe can reuse the kept-alive connection of HTTP check while HTTPS probe opens a tunnel
+        https, post = await asyncio.gather(self._timed_check('https', self._checker.check_proxy(proxy.addr, https=True)),
+                                           self._timed_check('post', self._checker.verify_post(proxy.addr)),
+                                           loop=self.loop)
+        https = bool(https and https[1] > 0)
+        proxy.label_time = int(time.time())
+        self._proxy_queue.set_label(proxy, https=https, post=bool(post))
 
     async def _supervisor(self):
         def supervise(name, futures, futures_done):
@@ -225,115 +559,254 @@ class ProxyManager:
             supervise('Label future', self._label_futures, self._label_futures_done)
             supervise('Future', self._futures, self._futures_done)
 
-    async def get_proxies(self, request):
+    async def get_metrics(self, request):
+        return web.Response(body=self.metrics.render().encode('utf-8'),
+                            content_type='text/plain', charset='utf-8',
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    async def get_stats(self, request):
+        stats = {'checker_clients': self._concurrency.limit,
+                 'running_checkers': self._concurrency.in_flight,
+                 'screen_queue': self._screen_queue.qsize(),
+                 'wait_queue': self._wait_queue.qsize(),
+                 'label_queue': self._label_queue.qsize(),
+                 'proxy_queue': len(self._proxy_queue),
+                 'proxy_db': len(self._proxy_db),
+                 'sources': self._spider.get_source_stats()}
+        for stage, (passed, failed) in self._stage_stats.items():
+            total = passed + failed
+            stats[stage] = {'passed': passed, 'failed': failed,
+                            'pass_rate': passed / total if total > 0 else None}
+        return web.json_response(stats)
+
+    async def get_changes(self, request):
         params = request.rel_url.query
-        count = params.get("count", 0)
-        if count:
-            count = int(count)
-        kwargs = {}
-        if 'order' in params:
-            kwargs['order'] = params.get('order')
-        if 'detail' in params:
-            kwargs['detail'] = True
-        if 'https' in params:
-            kwargs['https'] = True
-        if 'post' in params:
-            kwargs['post'] = True
-        min_anonymity = params.get('min_anonymity')
-        if min_anonymity is not None:
-            kwargs['min_anonymity'] = int(min_anonymity)
-        log.info('GET /proxies %s', kwargs)
-        proxy_list = self._get_proxies(count, **kwargs)
-        return web.Response(body=json.dumps(proxy_list).encode("utf-8"),
-                            charset="utf-8",
-                            content_type="application/json")
-
-    def _get_proxies(self, count, detail=False, order='rate', https=False, post=False, min_anonymity=0):
-        t = self._proxy_queue.get_proxies()
-        if min_anonymity > 0:
-            t = [i for i in t if i.anonymity >= min_anonymity]
-        if https:
-            t = [i for i in t if i.https]
-        if post:
-            t = [i for i in t if i.post]
-        if count <= 0 or len(t) < count:
-            count = len(t)
-        if order == 'rate':
-            t.sort(key=lambda k: k.rate, reverse=True)
-        elif order == 'time':
-            t.sort(key=lambda k: k.timestamp, reverse=True)
-        t = t[:count]
+        since = params.get('since')
+        changes = None
+        if since is not None and params.get('id', self._change_log.id) == self._change_log.id:
+            since = int(since)
+            timeout = min(float(params.get('timeout', self._change_poll_timeout)), self._change_poll_timeout)
+            if timeout > 0:
+                await self._change_log.wait(since, timeout)
+            changes = self._change_log.get_changes(since)
+        # clients should fetch the full list of proxies again when the changes are reset
+        res = {'id': self._change_log.id, 'seq': self._change_log.seq, 'reset': changes is None,
+               'changes': changes or []}
+        return web.json_response(res)
 
-        res = []
-        for p in t:
-            if detail:
-                res.append({"address": p.addr, "success": p.good, "fail": p.bad,
-                            'timestamp': p.timestamp - self._check_interval,
-                            'anonymity': p.anonymity, 'https': p.https, 'post': p.post})
-            else:
-                res.append(p.addr)
-        return res
+    async def get_proxies(self, request):
+        start_time = self.loop.time()
+        try:
+            return await self._proxies_endpoint.handle(request, self._proxy_queue)
+        finally:
+            self._request_duration.labels('/proxies').observe(self.loop.time() - start_time)
 
 
 class ProxyQueue:
-    def __init__(self, max_fail_times=3, min_anonymity=0):
+    def __init__(self, max_fail_times=3, min_anonymity=0, recheck_policy=None, change_log=None):
         self._max_fail_times = max_fail_times
         self._min_anonymity = min_anonymity
-        self._queue = deque()
-        self._backup = deque()
+        self._recheck_policy = recheck_policy
+        self._change_log = change_log
+        self._heap = []
+        self._seq = 0
+        self.generation = 0
+        self._good = set()
+        self._anonymity_index = {}
+        self._https_index = set()
+        self._post_index = set()
+        self._rate_index = SortedIndex()
+        self._time_index = SortedIndex()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def get_proxies(self, count=0, order=None, https=False, post=False, min_anonymity=0):
+        buckets = []
+        if https:
+            buckets.append(self._https_index)
+        if post:
+            buckets.append(self._post_index)
+        candidates = min(buckets, key=len) if buckets else self._good
+        size = len(candidates)
+        if min_anonymity > 0:
+            levels = [s for a, s in self._anonymity_index.items() if a >= min_anonymity]
+            n = sum(len(s) for s in levels)
+            if n < size:
+                candidates, size = chain(*levels), n
+
+        def match(p):
+            if p.anonymity < min_anonymity:
+                return False
+            for b in buckets:
+                if p not in b:
+                    return False
+            return True
 
-    def get_proxies(self):
-        res = [i for i in self._queue]
+        if order == 'rate':
+            index, key = self._rate_index, lambda p: p.rate
+        elif order == 'time':
+            index, key = self._time_index, lambda p: p.check_time
+        else:
+            index, key = None, None
+        if count <= 0 or count > size:
+            count = size
+        # walking the ordered index costs about count * len(good) / len(candidates) steps,
+        # a small bucket is cheaper to be partially sorted directly
+        if index is not None and size ** 2 >= count * len(self._good):
+            candidates = index
+        elif key is not None:
+            return heapq.nlargest(count, (p for p in candidates if match(p)), key=key)
+        res = []
+        if count > 0:
+            for p in candidates:
+                if match(p):
+                    res.append(p)
+                    if len(res) >= count:
+                        break
         return res
 
     def add_proxy(self, proxy):
+        self._seq += 1
+        heapq.heappush(self._heap, (proxy.timestamp, self._seq, proxy))
         if proxy.fail == 0:
-            self._queue.append(proxy)
+            self._index(proxy)
         else:
-            self._backup.append(proxy)
+            self._unindex(proxy)
+
+    def count_by_anonymity(self):
+        return {a: len(s) for a, s in self._anonymity_index.items()}
+
+    def set_label(self, proxy, https=False, post=False):
+        changed = proxy.https != https or proxy.post != post
+        proxy.https = https
+        proxy.post = post
+        if changed and proxy in self._good:
+            self.generation += 1
+            if https:
+                self._https_index.add(proxy)
+            else:
+                self._https_index.discard(proxy)
+            if post:
+                self._post_index.add(proxy)
+            else:
+                self._post_index.discard(proxy)
+            if self._change_log is not None:
+                self._change_log.append('update', proxy)
 
     def feed_back(self, proxy, res):
+        was_good, old_anonymity = proxy in self._good, proxy.anonymity
         ok = False
         if res:
             anonymity = res[1]
             proxy.anonymity = anonymity
             if anonymity >= self._min_anonymity:
                 ok = True
+        proxy.history = ((proxy.history << 1) | int(ok)) & HISTORY_MASK
         if ok:
             proxy.good += 1
             proxy.fail = 0
-            self.add_proxy(proxy)
         else:
             proxy.bad += 1
             proxy.fail += 1
-            if proxy.fail <= self._max_fail_times:
-                self.add_proxy(proxy)
+        if self._recheck_policy is not None:
+            proxy.timestamp = proxy.check_time + self._recheck_policy.get_interval(proxy)
+        if proxy.fail <= self._max_fail_times:
+            self.add_proxy(proxy)
+        else:
+            self._unindex(proxy)
+        if self._change_log is not None:
+            if ok != was_good:
+                self._change_log.append('add' if ok else 'remove', proxy)
+            elif ok and proxy.anonymity != old_anonymity:
+                self._change_log.append('update', proxy)
+
+    def next_timestamp(self):
+        if len(self._heap) > 0:
+            return self._heap[0][0]
 
     def get_expired_proxy(self):
         t = int(time.time())
-        p = None
-        if len(self._queue) > 0 and len(self._backup) > 0:
-            if t > self._queue[0].timestamp and t > self._backup[0].timestamp:
-                if self._queue[0].timestamp > self._backup[0].timestamp:
-                    p = self._backup.popleft()
-                else:
-                    p = self._queue.popleft()
-            elif t > self._queue[0].timestamp:
-                p = self._queue.popleft()
-            elif t > self._backup[0].timestamp:
-                p = self._backup.popleft()
-        elif len(self._queue) > 0:
-            if t > self._queue[0].timestamp:
-                p = self._queue.popleft()
-        elif len(self._backup) > 0:
-            if t > self._backup[0].timestamp:
-                p = self._backup.popleft()
-        return p
+        if len(self._heap) > 0 and t > self._heap[0][0]:
+            return self._pop()
+
+    def get_expired_proxies(self):
+        t = int(time.time())
+        res = []
+        while len(self._heap) > 0 and t > self._heap[0][0]:
+            res.append(self._pop())
+        return res
+
+    def _pop(self):
+        # expired proxies are still available until they are fed back
+        return heapq.heappop(self._heap)[2]
+
+    def _index(self, proxy):
+        self.generation += 1
+        self._good.add(proxy)
+        for a, s in self._anonymity_index.items():
+            if a != proxy.anonymity:
+                s.discard(proxy)
+        self._anonymity_index.setdefault(proxy.anonymity, set()).add(proxy)
+        if proxy.https:
+            self._https_index.add(proxy)
+        else:
+            self._https_index.discard(proxy)
+        if proxy.post:
+            self._post_index.add(proxy)
+        else:
+            self._post_index.discard(proxy)
+        self._rate_index.add(proxy, -proxy.rate)
+        self._time_index.add(proxy, -proxy.check_time)
+
+    def _unindex(self, proxy):
+        if proxy in self._good:
+            self.generation += 1
+            self._good.discard(proxy)
+            # the anonymity may have been changed by the feedback
+            for s in self._anonymity_index.values():
+                s.discard(proxy)
+            self._https_index.discard(proxy)
+            self._post_index.discard(proxy)
+            self._rate_index.discard(proxy)
+            self._time_index.discard(proxy)
+
+
+class RecheckPolicy:
+    """
+    Stretch the check interval of the proxies which keep passing checks and shorten it for new or flaky ones.
+    """
+
+    def __init__(self, check_interval, min_interval=None, max_interval=None, stable_checks=4):
+        self.check_interval = check_interval
+        self.min_interval = min_interval or check_interval
+        self.max_interval = max_interval or check_interval
+        self.stable_checks = stable_checks
+
+    def get_interval(self, proxy):
+        n = min(proxy.good + proxy.bad, HISTORY_SIZE)
+        if n <= 1 or proxy.fail > 0:
+            interval = self.min_interval
+        else:
+            history = proxy.history & ((1 << n) - 1)
+            successes = bin(history).count('1')
+            if successes == n:
+                # double the interval after every a few successive passed checks
+                interval = self.check_interval * 2 ** min(proxy.good // self.stable_checks, 16)
+            else:
+                interval = self.check_interval * successes / n
+        return int(min(max(interval, self.min_interval), self.max_interval))
 
 
 class ProxyInfo:
-    def __init__(self, addr, timestamp, *, good=0, bad=0, fail=1, anonymity=0, https=False, post=False):
-        self.addr = addr
+    __slots__ = ('key', 'timestamp', 'good', 'bad', 'fail', 'anonymity', 'https', 'post',
+                 'check_time', 'label_time', 'history', 'source', 'latency')
+
+    def __init__(self, addr, timestamp, *, good=0, bad=0, fail=1, anonymity=0, https=False, post=False,
+                 check_time=None, label_time=0, history=0, source=None, latency=None):
+        if isinstance(addr, str):
+            addr = pack_addr(addr)
+        self.key = addr
         self.timestamp = timestamp
         self.good = good
         self.bad = bad
@@ -341,6 +814,15 @@ class ProxyInfo:
         self.anonymity = anonymity
         self.https = https
         self.post = post
+        self.check_time = timestamp if check_time is None else check_time
+        self.label_time = label_time
+        self.history = history
+        self.source = source
+        self.latency = latency
+
+    @property
+    def addr(self):
+        return unpack_addr(self.key)
 
     @property
     def rate(self):
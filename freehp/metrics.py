@@ -0,0 +1,176 @@
+# coding=utf-8
+
+from bisect import bisect_left
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self):
+        lines = []
+        for m in self._metrics:
+            lines.append('# HELP {} {}\n'.format(m.name, m.documentation))
+            lines.append('# TYPE {} {}\n'.format(m.name, m.type))
+            lines.extend(m.render())
+        return ''.join(lines)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = ['{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+             for k, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(v):
+    if v == float('inf'):
+        return '+Inf'
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return str(v)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError('Incorrect label count')
+            child = self._new_child()
+            self._children[values] = child
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _default(self):
+        return self.labels()
+
+    def render(self):
+        raise NotImplementedError
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def render(self):
+        return ['{}{} {}\n'.format(self.name, _format_labels(self.labelnames, k), _format_value(c.value))
+                for k, c in self._children.items()]
+
+
+class Gauge(_Metric):
+    """
+    The value can also be collected by a callback when rendering,
+    which returns either a single value or a dict mapping label values to values.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, callback=None):
+        super().__init__(name, documentation, labelnames=labelnames, registry=registry)
+        self.callback = callback
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+    def render(self):
+        if self.callback is not None:
+            v = self.callback()
+            if isinstance(v, dict):
+                items = [((i if isinstance(i, tuple) else (i,)), j) for i, j in v.items()]
+            else:
+                items = [((), v)]
+        else:
+            items = [(k, c.value) for k, c in self._children.items()]
+        return ['{}{} {}\n'.format(self.name, _format_labels(self.labelnames, k), _format_value(v))
+                for k, v in items]
+
+
+class _HistogramValue:
+    __slots__ = ('upper_bounds', 'counts', 'sum')
+
+    def __init__(self, upper_bounds):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames=labelnames, registry=registry)
+        self.upper_bounds = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.upper_bounds)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def render(self):
+        lines = []
+        for k, h in self._children.items():
+            n = 0
+            for b, c in zip(self.upper_bounds + (float('inf'),), h.counts):
+                n += c
+                le = 'le="{}"'.format(_format_value(float(b)))
+                lines.append('{}_bucket{} {}\n'.format(self.name, _format_labels(self.labelnames, k, le), n))
+            lines.append('{}_sum{} {}\n'.format(self.name, _format_labels(self.labelnames, k), _format_value(h.sum)))
+            lines.append('{}_count{} {}\n'.format(self.name, _format_labels(self.labelnames, k), n))
+        return lines
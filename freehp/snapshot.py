@@ -0,0 +1,39 @@
+# coding=utf-8
+
+import os
+import gzip
+import json
+
+SNAPSHOT_VERSION = 2
+
+FIELDS = ('addr', 'timestamp', 'good', 'bad', 'fail', 'anonymity', 'https', 'post',
+          'check_time', 'label_time', 'history', 'source', 'latency')
+
+
+def dump_snapshot(fname, records):
+    """
+    Write records to a gzip compressed JSON file atomically.
+    """
+    data = json.dumps({'version': SNAPSHOT_VERSION, 'fields': FIELDS, 'records': records},
+                      separators=(',', ':')).encode('utf-8')
+    tmp_file = '{}.tmp.{}'.format(fname, os.getpid())
+    try:
+        with open(tmp_file, 'wb') as f:
+            with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=6) as g:
+                g.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, fname)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def load_snapshot(fname):
+    with gzip.open(fname, 'rb') as f:
+        data = json.loads(f.read().decode('utf-8'))
+    # records are loaded by the fields they were saved with, missing fields take the defaults
+    if data.get('version') not in range(1, SNAPSHOT_VERSION + 1):
+        raise ValueError('Unsupported snapshot version: {}'.format(data.get('version')))
+    fields = data['fields']
+    return [dict(zip(fields, r)) for r in data['records']]
@@ -1,34 +1,71 @@
 # coding=utf-8
 
 import time
+import codecs
+import hashlib
+import random
 import asyncio
 import logging
 from asyncio import CancelledError
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 import aiohttp
 import async_timeout
 
-from freehp.extractor import extract_proxies
+from freehp.extractor import ProxyExtractor, extract_proxies_batch
+from freehp.metrics import Counter, Histogram
 
 log = logging.getLogger(__name__)
 
+READ_CHUNK_SIZE = 65536
+
 
 class ProxySpider:
-    def __init__(self, config, loop=None):
+    def __init__(self, config, loop=None, metrics=None):
         self._proxy_pages = config.get('proxy_pages', {})
         log.debug('Details of proxy pages: %s', [i for i in self._proxy_pages])
         self._scrap_interval = config.getint("scrap_interval")
+        self._min_scrap_interval = config.getint("min_scrap_interval") or self._scrap_interval
+        self._max_scrap_interval = config.getint("max_scrap_interval") or self._scrap_interval
         self._timeout = config.getint("spider_timeout")
         self._sleep_time = config.getint("spider_sleep_time")
         self._headers = config.get("spider_headers", {})
+        self._concurrency = config.getint("spider_concurrency")
+        self._rate_limit = config.getfloat("spider_rate_limit")
+        if not self._rate_limit and self._sleep_time > 0:
+            self._rate_limit = 1 / self._sleep_time
+        self._retry_times = config.getint("spider_retry_times")
+        self._backoff_base = config.getfloat("spider_backoff_base")
+        self._backoff_max = config.getfloat("spider_backoff_max")
         self._loop = loop or asyncio.get_event_loop()
+        extractor = config.get('spider_extractor')
+        if extractor:
+            self._extractor_pool = ExtractorPool(extractor,
+                                                 max_workers=config.getint('spider_extractor_workers'),
+                                                 batch_size=config.getint('spider_extractor_batch_size'),
+                                                 loop=self._loop)
+        else:
+            self._extractor_pool = None
+
+        self._fetch_duration = Histogram('freehp_spider_fetch_duration_seconds', 'Duration of fetching proxy pages',
+                                         ['source', 'result'], registry=metrics)
+        self._proxies_total = Counter('freehp_spider_proxies_total', 'Number of proxies found on proxy pages',
+                                      ['source'], registry=metrics)
+
+        self._source_stats = {name: SourceStats() for name in self._proxy_pages}
+        self._page_validators = {}
+        self._page_fingerprints = {}
 
         self.futures = None
         self._receivers = []
+        self._sessions = {}
+        self._semaphores = {}
+        self._buckets = {}
 
     @classmethod
     def from_manager(cls, manager):
-        return cls(manager.config, loop=manager.loop)
+        return cls(manager.config, loop=manager.loop, metrics=getattr(manager, 'metrics', None))
 
     def subscribe(self, receiver):
         self._receivers.append(receiver)
@@ -36,7 +73,7 @@ class ProxySpider:
     def open(self):
         self.futures = []
         for p in self._proxy_pages:
-            f = asyncio.ensure_future(self._update_proxy_task(self._proxy_pages[p]), loop=self._loop)
+            f = asyncio.ensure_future(self._update_proxy_task(p, self._proxy_pages[p]), loop=self._loop)
             self.futures.append(f)
 
     def close(self):
@@ -45,37 +82,267 @@ class ProxySpider:
                 f.cancel()
             self.futures = None
 
-    async def _update_proxy_task(self, urls):
+    async def cleanup(self):
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for s in sessions:
+            await s.close()
+        if self._extractor_pool is not None:
+            self._extractor_pool.close()
+
+    def record_passed(self, source):
+        stats = self._source_stats.get(source)
+        if stats is not None:
+            stats.passed += 1
+
+    def get_source_stats(self):
+        return {name: stats.to_dict() for name, stats in self._source_stats.items()}
+
+    async def _update_proxy_task(self, name, urls):
         if not isinstance(urls, list):
             urls = [urls]
         while True:
-            t = await self._update_proxy(urls)
-            t = self._scrap_interval - t
+            t = await self._update_proxy(name, urls)
+            t = self._get_scrap_interval(name) - t
             if t > self._sleep_time:
                 await asyncio.sleep(t, loop=self._loop)
 
-    async def _update_proxy(self, urls):
+    async def _update_proxy(self, name, urls):
         start_time = time.time()
-        for url in urls:
-            retry_cnt = 3
-            while retry_cnt > 0:
-                retry_cnt -= 1
+        res = await asyncio.gather(*[self._update_page(name, url) for url in urls], loop=self._loop)
+        found, new = 0, 0
+        for i, j in res:
+            found += i
+            new += j
+        self._source_stats[name].record_scrape(found, new)
+        return time.time() - start_time
+
+    def _get_scrap_interval(self, name):
+        stats = self._source_stats[name]
+        scores = [i.score for i in self._source_stats.values() if i.score is not None]
+        if stats.score is None or not scores:
+            interval = self._scrap_interval
+        elif stats.score <= 0:
+            interval = self._max_scrap_interval
+        else:
+            # sources with higher yield than average are scraped more frequently
+            interval = self._scrap_interval * (sum(scores) / len(scores)) / stats.score
+        interval = min(max(interval, self._min_scrap_interval), self._max_scrap_interval)
+        stats.interval = interval
+        return interval
+
+    async def _update_page(self, name, url):
+        found, new = 0, 0
+        start_time = self._loop.time()
+        proxies = await self._fetch(url)
+        self._fetch_duration.labels(name, 'failure' if proxies is None else 'success') \
+            .observe(self._loop.time() - start_time)
+        if proxies is not None:
+            self._proxies_total.labels(name).inc(len(proxies))
+            log.debug("Find %s proxies on the page '%s'", len(proxies), url)
+            found = len(proxies)
+            if proxies:
+                for r in self._receivers:
+                    n = await r(proxies, source=name)
+                    if n:
+                        new += n
+        return found, new
+
+    async def _fetch(self, url):
+        host = urlsplit(url).netloc
+        session = self._get_session(host)
+        semaphore = self._semaphores[host]
+        bucket = self._buckets[host]
+        for i in range(self._retry_times):
+            if i > 0:
+                await asyncio.sleep(self._get_retry_delay(i), loop=self._loop)
+            async with semaphore:
+                await bucket.acquire()
                 try:
-                    async with aiohttp.ClientSession(loop=self._loop) as session:
-                        with async_timeout.timeout(self._timeout, loop=self._loop):
-                            async with session.request("GET", url, headers=self._headers) as resp:
-                                body = await resp.read()
-                                body = body.decode('utf-8', errors='ignore')
+                    with async_timeout.timeout(self._timeout, loop=self._loop):
+                        async with session.request("GET", url, headers=self._get_headers(url)) as resp:
+                            if resp.status == 304:
+                                log.debug("Proxy page '%s' is not modified", url)
+                                return []
+                            hasher = hashlib.sha1()
+                            # only the extractor pool needs the whole body, otherwise the page is extracted
+                            # while being read and the result is dropped if the page turns out to be unchanged
+                            if self._extractor_pool is not None:
+                                chunks = []
+                            else:
+                                extractor = ProxyExtractor()
+                                decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+                            async for chunk in resp.content.iter_chunked(READ_CHUNK_SIZE):
+                                hasher.update(chunk)
+                                if self._extractor_pool is not None:
+                                    chunks.append(chunk)
+                                else:
+                                    extractor.feed(decoder.decode(chunk))
+                            validators = (resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
+                    break
                 except CancelledError:
                     raise
                 except Exception as e:
                     log.info("Failed to scrap proxy on '%s': %s", url, e)
-                else:
-                    retry_cnt = 0
-                    proxies = extract_proxies(body)
-                    log.debug("Find %s proxies on the page '%s'", len(proxies), url)
-                    if proxies:
-                        for r in self._receivers:
-                            await r(proxies)
-                await asyncio.sleep(self._sleep_time, loop=self._loop)
-        return time.time() - start_time
+        else:
+            return None
+        if validators[0] or validators[1]:
+            self._page_validators[url] = validators
+        else:
+            self._page_validators.pop(url, None)
+        fingerprint = hasher.digest()
+        if self._page_fingerprints.get(url) == fingerprint:
+            log.debug("Content of proxy page '%s' is unchanged", url)
+            return []
+        self._page_fingerprints[url] = fingerprint
+        if self._extractor_pool is not None:
+            return await self._extractor_pool.extract(b''.join(chunks))
+        extractor.feed(decoder.decode(b'', final=True))
+        return extractor.close()
+
+    def _get_retry_delay(self, retry_times):
+        # the jitter keeps retries against the same host from being synchronized
+        delay = min(self._backoff_max, self._backoff_base * 2 ** (retry_times - 1))
+        return random.uniform(delay / 2, delay)
+
+    def _get_headers(self, url):
+        validators = self._page_validators.get(url)
+        if validators is None:
+            return self._headers
+        headers = dict(self._headers)
+        etag, last_modified = validators
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def _get_session(self, host):
+        session = self._sessions.get(host)
+        if session is None:
+            connector = aiohttp.TCPConnector(limit_per_host=self._concurrency, loop=self._loop)
+            session = aiohttp.ClientSession(connector=connector, loop=self._loop)
+            self._sessions[host] = session
+            self._semaphores[host] = asyncio.Semaphore(self._concurrency, loop=self._loop)
+            self._buckets[host] = TokenBucket(self._rate_limit, capacity=self._concurrency, loop=self._loop)
+        return session
+
+
+class SourceStats:
+    def __init__(self, smoothing=0.3):
+        self.smoothing = smoothing
+        self.scrapes = 0
+        self.found = 0
+        self.new = 0
+        self.passed = 0
+        self.new_per_scrape = None
+        self.interval = None
+
+    def record_scrape(self, found, new):
+        self.scrapes += 1
+        self.found += found
+        self.new += new
+        if self.new_per_scrape is None:
+            self.new_per_scrape = new
+        else:
+            self.new_per_scrape = (1 - self.smoothing) * self.new_per_scrape + self.smoothing * new
+
+    @property
+    def pass_rate(self):
+        return (self.passed + 1) / (self.new + 2)
+
+    @property
+    def score(self):
+        """
+        Estimated number of available proxies gained by each scrape.
+        """
+        if self.new_per_scrape is None:
+            return None
+        return self.new_per_scrape * self.pass_rate
+
+    def to_dict(self):
+        return {'scrapes': self.scrapes, 'found': self.found, 'new': self.new, 'passed': self.passed,
+                'score': self.score, 'interval': self.interval}
+
+
+class ExtractorPool:
+    """
+    Extract proxies in a thread or process pool, small pages are submitted in batches.
+    """
+
+    def __init__(self, mode='process', max_workers=None, batch_size=65536, batch_delay=0.05, loop=None):
+        self._loop = loop or asyncio.get_event_loop()
+        if mode == 'process':
+            self._executor = ProcessPoolExecutor(max_workers=max_workers)
+        elif mode == 'thread':
+            self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        else:
+            raise ValueError("Unknown extractor mode '{}'".format(mode))
+        self._batch_size = batch_size
+        self._batch_delay = batch_delay
+        self._pages = []
+        self._waiters = []
+        self._pending_size = 0
+        self._timer = None
+
+    async def extract(self, body):
+        f = self._loop.create_future()
+        self._pages.append(body)
+        self._waiters.append(f)
+        self._pending_size += len(body)
+        if self._pending_size >= self._batch_size:
+            self._submit()
+        elif self._timer is None:
+            self._timer = self._loop.call_later(self._batch_delay, self._submit)
+        return await f
+
+    def close(self):
+        self._submit()
+        self._executor.shutdown(wait=False)
+
+    def _submit(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pages:
+            return
+        pages, waiters = self._pages, self._waiters
+        self._pages, self._waiters = [], []
+        self._pending_size = 0
+
+        def done(f):
+            if f.cancelled():
+                for w in waiters:
+                    w.cancel()
+            elif f.exception() is not None:
+                for w in waiters:
+                    if not w.done():
+                        w.set_exception(f.exception())
+            else:
+                for w, r in zip(waiters, f.result()):
+                    if not w.done():
+                        w.set_result(r)
+
+        f = self._loop.run_in_executor(self._executor, extract_proxies_batch, pages)
+        f.add_done_callback(done)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=1, loop=None):
+        self._loop = loop or asyncio.get_event_loop()
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last_time = self._loop.time()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            now = self._loop.time()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last_time) * self.rate)
+            self._last_time = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate, loop=self._loop)
@@ -6,6 +6,8 @@ import signal
 import json
 from asyncio import CancelledError
 import os
+import time
+import shlex
 import inspect
 
 import aiohttp
@@ -17,7 +19,7 @@ log = logging.getLogger(__name__)
 
 
 class Squid:
-    PEER_CONF = 'cache_peer {} parent {} 0 no-query weighted-round-robin weight=1 connect-fail-limit=2 allow-miss max-conn=5 name={}\n'
+    PEER_CONF = 'cache_peer {0} parent {1} 0 no-query weighted-round-robin weight={3} connect-fail-limit=2 allow-miss max-conn={4} name={2}\n'
     PEER_ACCESS_CONF = 'cache_peer_access {} {} {}\n'
 
     def __init__(self, dest_file, tpl_file, config=None):
@@ -31,6 +33,12 @@ class Squid:
             self._template = f.read().decode()
         self._config = config or SquidConfig()
         self._request_urls = self._construct_request_urls()
+        # peer configuration applied to squid, name -> lines
+        self._applied_peers = None
+        self._reload_time = 0
+        self._session = None
+        # last known good results of each request URL
+        self._last_results = {}
         self._futures = None
         self._is_running = False
 
@@ -64,6 +72,7 @@ class Squid:
             if self._config.getbool('once'):
                 log.info('Run only once')
                 self.loop.run_until_complete(self._maintain_squid())
+                self.loop.run_until_complete(self._close_session())
                 self._is_running = False
                 log.info('Task is done')
             else:
@@ -94,6 +103,7 @@ class Squid:
                 f.cancel()
             self._futures = None
         await asyncio.sleep(0.001, loop=self.loop)
+        await self._close_session()
         self.loop.remove_signal_handler(signal.SIGINT)
         self.loop.remove_signal_handler(signal.SIGTERM)
         self.loop.stop()
@@ -109,39 +119,81 @@ class Squid:
         data = []
         proxies = set()
         timeout = self._config.getfloat('timeout')
-        try:
-            for url in self._request_urls:
-                async with aiohttp.ClientSession(loop=self.loop) as session:
-                    with async_timeout.timeout(timeout, loop=self.loop):
-                        log.debug('Request url: %s', url)
-                        async with session.get(url) as resp:
-                            body = await resp.read()
-                            d = json.loads(body.decode('utf-8'))
-                            for i in d:
-                                a = i['address']
-                                if a not in proxies:
-                                    proxies.add(a)
-                                    data.append(i)
-            log.debug('Get %s proxies', len(data))
-        except CancelledError:
-            raise
-        except Exception:
-            log.error("Failed to get proxies", exc_info=True)
+        if self._session is None:
+            self._session = aiohttp.ClientSession(loop=self.loop)
+        futures = [self._fetch_proxies(url, timeout) for url in self._request_urls]
+        for f in asyncio.as_completed(futures, loop=self.loop):
+            url, d = await f
+            if d is None:
+                d = self._last_results.get(url)
+                if d is None:
+                    continue
+                log.warning("Use last known %s proxies of '%s'", len(d), url)
+            else:
+                self._last_results[url] = d
+            for i in d:
+                a = i['address']
+                if a not in proxies:
+                    proxies.add(a)
+                    data.append(i)
+        log.debug('Get %s proxies', len(data))
 
         if len(data) > 0:
             try:
-                self._reconfigure_squid(data)
+                await self._reconfigure_squid(data)
+            except CancelledError:
+                raise
             except Exception:
                 log.error("Failed to reconfigure squid", exc_info=True)
 
-    def _reconfigure_squid(self, proxies):
-        min_anonymity = self._config.getint('min_anonymity')
-        squid = self._config.get('squid')
+    async def _fetch_proxies(self, url, timeout):
+        try:
+            with async_timeout.timeout(timeout, loop=self.loop):
+                log.debug('Request url: %s', url)
+                async with self._session.get(url) as resp:
+                    resp.raise_for_status()
+                    body = await resp.read()
+                    data = json.loads(body.decode('utf-8'))
+                    if not isinstance(data, list) or not all(isinstance(i, dict) and 'address' in i for i in data):
+                        raise ValueError('Unexpected response: {}'.format(body[:100]))
+                    return url, data
+        except CancelledError:
+            raise
+        except Exception:
+            log.error("Failed to get proxies from '%s'", url, exc_info=True)
+        return url, None
+
+    async def _close_session(self):
+        if self._session is not None:
+            session, self._session = self._session, None
+            await session.close()
+
+    async def _reconfigure_squid(self, proxies):
+        peers = self._make_peers(proxies)
+        if not self._need_reload(peers):
+            return
         lines = [self._template, '\n# cache_peer configuration\n']
+        for name in sorted(peers):
+            lines.extend(peers[name])
+        self._write_configuration(''.join(lines))
+        log.info('Reconfigure squid with %s proxies, conf=%s', len(peers), self._dest_file)
+        try:
+            await self._reload_squid()
+        except Exception:
+            self._applied_peers = None
+            self._recover_configuration()
+            raise
+        self._applied_peers = peers
+        self._reload_time = time.time()
+
+    def _make_peers(self, proxies):
+        min_anonymity = self._config.getint('min_anonymity')
+        peers = {}
         for p in proxies:
             host, port = p['address'].split(':')
             name = host + '.' + port
-            lines.append(self.PEER_CONF.format(host, port, name))
+            weight, max_conn = self._get_peer_weight(p)
+            lines = [self.PEER_CONF.format(host, port, name, weight, max_conn)]
             dl = []
             if p['anonymity'] < min_anonymity:
                 dl.append('!SSL_ports')
@@ -151,20 +203,65 @@ class Squid:
                 dl.append('POST')
             if len(dl) > 0:
                 lines.append(self.PEER_ACCESS_CONF.format(name, 'deny', ' '.join(dl)))
-
-        with open(self._dest_file, 'w') as f:
-            f.writelines(lines)
-        log.info('Reconfigure squid with %s proxies, conf=%s', len(proxies), self._dest_file)
+            peers[name] = tuple(lines)
+        return peers
+
+    def _get_peer_weight(self, proxy):
+        """
+        Map the success rate, anonymity and latency of the proxy to the weight and max-conn of the peer.
+        """
+        success, fail = proxy.get('success', 0), proxy.get('fail', 0)
+        score = (success + 1) / (success + fail + 2)
+        anonymity_weights = [float(i) for i in self._config.getlist('peer_anonymity_weights') or []]
+        if anonymity_weights:
+            score *= anonymity_weights[min(proxy.get('anonymity', 0), len(anonymity_weights) - 1)]
+        latency = proxy.get('latency')
+        if latency:
+            score *= min(1.0, self._config.getfloat('peer_latency_target') / latency)
+        weight = max(1, int(round(score * self._config.getint('peer_max_weight'))))
+        min_conn = self._config.getint('peer_min_conn')
+        max_conn = max(min_conn, int(round(score * self._config.getint('peer_max_conn'))))
+        return weight, max_conn
+
+    def _need_reload(self, peers):
+        applied = self._applied_peers
+        if applied is None:
+            return True
+        changed = len(peers.keys() ^ applied.keys())
+        for name in peers.keys() & applied.keys():
+            if peers[name] != applied[name]:
+                changed += 1
+        if changed == 0:
+            log.debug('Peers of squid are not changed')
+            return False
+        # small changes are deferred until enough changes are accumulated or the configuration gets too old
+        threshold = self._config.getfloat('reload_threshold') * max(len(applied), 1)
+        if changed < threshold and time.time() - self._reload_time < self._config.getfloat('max_reload_interval'):
+            log.debug('Defer reconfiguring squid, %s peers changed', changed)
+            return False
+        return True
+
+    async def _reload_squid(self):
+        cmd = shlex.split(self._config.get('squid')) + ['-k', 'reconfigure']
+        proc = await asyncio.create_subprocess_exec(*cmd, loop=self.loop)
         try:
-            if os.system('{} -k reconfigure'.format(squid)) != 0:
-                raise RuntimeError
-        except RuntimeError:
-            self._recover_configuration()
-            raise
+            with async_timeout.timeout(self._config.getfloat('reload_timeout'), loop=self.loop):
+                code = await proc.wait()
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise RuntimeError('Reloading squid timed out')
+        if code != 0:
+            raise RuntimeError('Reloading squid exited with code {}'.format(code))
+
+    def _write_configuration(self, content):
+        tmp_file = '{}.tmp'.format(self._dest_file)
+        with open(tmp_file, 'w') as f:
+            f.write(content)
+        os.replace(tmp_file, self._dest_file)
 
     def _recover_configuration(self):
-        with open(self._dest_file, 'w') as f:
-            f.write(self._template)
+        self._write_configuration(self._template)
 
 
 class AddressSetting(Setting):
@@ -225,6 +322,63 @@ class TimeoutSetting(Setting):
     short_desc = 'timeout in seconds'
 
 
+class PeerMaxWeightSetting(Setting):
+    name = 'peer_max_weight'
+    cli = ['--peer-max-weight']
+    metavar = 'INT'
+    type = int
+    default = 10
+    short_desc = 'weight of the best peers, the weight of others is scaled down by their quality'
+
+
+class PeerMinConnSetting(Setting):
+    name = 'peer_min_conn'
+    default = 2
+
+
+class PeerMaxConnSetting(Setting):
+    name = 'peer_max_conn'
+    cli = ['--peer-max-conn']
+    metavar = 'INT'
+    type = int
+    default = 20
+    short_desc = 'max-conn of the best peers, the max-conn of others is scaled down by their quality'
+
+
+class PeerAnonymityWeightsSetting(Setting):
+    name = 'peer_anonymity_weights'
+    default = [0.6, 0.8, 1.0]
+
+
+class PeerLatencyTargetSetting(Setting):
+    name = 'peer_latency_target'
+    default = 1.0
+
+
+class ReloadThresholdSetting(Setting):
+    name = 'reload_threshold'
+    cli = ['--reload-threshold']
+    metavar = 'FLOAT'
+    type = float
+    default = 0.1
+    short_desc = 'defer reconfiguring squid until this fraction of peers are changed'
+
+
+class MaxReloadIntervalSetting(Setting):
+    name = 'max_reload_interval'
+    cli = ['--max-reload-interval']
+    metavar = 'SECONDS'
+    type = float
+    default = 1800
+    short_desc = 'maximal interval in seconds to apply deferred changes'
+
+
+class ReloadTimeoutSetting(Setting):
+    name = 'reload_timeout'
+    type = float
+    default = 30
+
+
 class OnceSetting(Setting):
     name = 'once'
     cli = ['--once']
@@ -21,6 +21,27 @@ def load_object(path):
     return path
 
 
+def pack_addr(addr):
+    """
+    Pack an IPv4 address and port like '1.2.3.4:8080' into an integer.
+    """
+    ip, port = addr.split(':')
+    n = 0
+    for i in ip.split('.'):
+        i = int(i)
+        if not 0 <= i <= 255:
+            raise ValueError('Invalid address: {}'.format(addr))
+        n = (n << 8) | i
+    port = int(port)
+    if not 0 <= port <= 65535 or ip.count('.') != 3:
+        raise ValueError('Invalid address: {}'.format(addr))
+    return (n << 16) | port
+
+
+def unpack_addr(n):
+    return '{}.{}.{}.{}:{}'.format(n >> 40, (n >> 32) & 0xff, (n >> 24) & 0xff, (n >> 16) & 0xff, n & 0xffff)
+
+
 def load_config(fname):
     if fname is None or not isfile(fname):
         raise ValueError('{} is not a file'.format(fname))
@@ -74,14 +95,14 @@ def be_daemon():
     os.dup2(fd_null, 2)
 
 
-async def get_origin_ip(loop):
+async def get_origin_ip(loop, url='http://httpbin.org/get'):
     import re
     ip = None
     ip_reg = re.compile('^[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}$')
     try:
         async with aiohttp.ClientSession(loop=loop) as session:
             with async_timeout.timeout(30, loop=loop):
-                async with session.request('GET', 'http://httpbin.org/get') as resp:
+                async with session.request('GET', url) as resp:
                     body = await resp.read()
                     data = json.loads(body.decode())
                     ip = data['origin']
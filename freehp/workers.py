@@ -0,0 +1,190 @@
+# coding=utf-8
+
+import json
+import signal
+import socket
+import asyncio
+import logging
+import multiprocessing
+from asyncio import CancelledError
+
+from freehp.utils import load_object, configure_logging
+
+log = logging.getLogger(__name__)
+
+
+class CheckerWorkerPool:
+    """
+    Run the checker in worker processes.
+
+    Calls are streamed to the workers as JSON lines over socket pairs and the results are streamed back as soon as
+    they are ready, the manager process keeps the only copy of the proxy queue.
+    """
+
+    def __init__(self, checker_cls, config, *, workers=2, shutdown_timeout=5, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.checker_cls = checker_cls
+        self.config = config
+        self.workers = workers
+        self.shutdown_timeout = shutdown_timeout
+        self._ctx = multiprocessing.get_context('spawn')
+        self._workers = []
+        self._seq = 0
+        self._closing = False
+
+    @classmethod
+    def from_manager(cls, manager):
+        config = manager.config
+        return cls(config.get('checker'), config, workers=config.getint('checker_workers'), loop=manager.loop)
+
+    async def open(self):
+        self._closing = False
+        while len(self._workers) < self.workers:
+            await self._spawn()
+
+    async def close(self):
+        self._closing = True
+        workers, self._workers = self._workers, []
+        if not workers:
+            return
+        # workers finish the running calls and exit once they read EOF
+        for w in workers:
+            if w.writer.can_write_eof():
+                w.writer.write_eof()
+        await asyncio.wait([w.future for w in workers], timeout=self.shutdown_timeout, loop=self.loop)
+        for w in workers:
+            w.future.cancel()
+            w.writer.close()
+            await self.loop.run_in_executor(None, w.process.join, self.shutdown_timeout)
+            if w.process.is_alive():
+                log.warning('Terminate checker worker %s', w.process.pid)
+                w.process.terminate()
+
+    async def check_proxy(self, addr, https=False):
+        return await self._call('check_proxy', addr, https=https)
+
+    async def verify_post(self, addr):
+        return await self._call('verify_post', addr)
+
+    async def _spawn(self):
+        parent_sock, child_sock = socket.socketpair()
+        p = self._ctx.Process(target=run_worker, args=(child_sock, self.checker_cls, self.config), daemon=True)
+        p.start()
+        child_sock.close()
+        reader, writer = await asyncio.open_connection(sock=parent_sock, loop=self.loop)
+        worker = _Worker(p, reader, writer)
+        worker.future = asyncio.ensure_future(self._read_results(worker), loop=self.loop)
+        self._workers.append(worker)
+        log.info('Start checker worker %s', p.pid)
+
+    async def _call(self, method, *args, **kwargs):
+        if not self._workers:
+            await self.open()
+        worker = min(self._workers, key=lambda w: len(w.pending))
+        self._seq += 1
+        seq = self._seq
+        fut = self.loop.create_future()
+        worker.pending[seq] = fut
+        worker.writer.write(json.dumps([seq, method, args, kwargs]).encode() + b'\n')
+        try:
+            return await fut
+        except CancelledError:
+            if not worker.writer.transport.is_closing():
+                worker.writer.write(json.dumps([seq, 'cancel', [], {}]).encode() + b'\n')
+            raise
+        finally:
+            worker.pending.pop(seq, None)
+
+    async def _read_results(self, worker):
+        try:
+            while True:
+                line = await worker.reader.readline()
+                if not line:
+                    break
+                seq, res = json.loads(line.decode())
+                fut = worker.pending.get(seq)
+                if fut is not None and not fut.done():
+                    fut.set_result(tuple(res) if isinstance(res, list) else res)
+        except CancelledError:
+            raise
+        except Exception:
+            log.warning('Failed to read results of checker worker %s', worker.process.pid, exc_info=True)
+        finally:
+            for fut in worker.pending.values():
+                if not fut.done():
+                    fut.set_exception(ConnectionError('Checker worker {} exited'.format(worker.process.pid)))
+            if not self._closing and worker in self._workers:
+                log.warning('Checker worker %s exited unexpectedly', worker.process.pid)
+                self._workers.remove(worker)
+                worker.writer.close()
+                asyncio.ensure_future(self._spawn(), loop=self.loop)
+
+
+class _Worker:
+    def __init__(self, process, reader, writer):
+        self.process = process
+        self.reader = reader
+        self.writer = writer
+        self.pending = {}
+        self.future = None
+
+
+class _WorkerContext:
+    def __init__(self, config, loop):
+        self.config = config
+        self.loop = loop
+        self.metrics = None
+
+
+def run_worker(sock, checker_cls, config):
+    # the manager process handles signals and closes the socket to shut down the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    configure_logging('freehp', config)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(_serve(sock, checker_cls, config, loop))
+    finally:
+        loop.close()
+
+
+async def _serve(sock, checker_cls, config, loop):
+    checker_cls = load_object(checker_cls)
+    if hasattr(checker_cls, 'from_manager'):
+        checker = checker_cls.from_manager(_WorkerContext(config, loop))
+    else:
+        checker = checker_cls()
+    if hasattr(checker, 'open'):
+        await checker.open()
+    reader, writer = await asyncio.open_connection(sock=sock, loop=loop)
+    tasks = {}
+
+    async def _run(seq, method, args, kwargs):
+        try:
+            res = await getattr(checker, method)(*args, **kwargs)
+        except CancelledError:
+            return
+        except Exception:
+            log.warning("Failed to call '%s' of the checker", method, exc_info=True)
+            res = False
+        finally:
+            tasks.pop(seq, None)
+        writer.write(json.dumps([seq, res]).encode() + b'\n')
+
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        seq, method, args, kwargs = json.loads(line.decode())
+        if method == 'cancel':
+            t = tasks.get(seq)
+            if t is not None:
+                t.cancel()
+        elif method in ('check_proxy', 'verify_post'):
+            tasks[seq] = asyncio.ensure_future(_run(seq, method, args, kwargs), loop=loop)
+    if tasks:
+        await asyncio.wait(list(tasks.values()), loop=loop)
+    if hasattr(checker, 'close'):
+        await checker.close()
+    writer.close()
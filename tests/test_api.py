@@ -0,0 +1,72 @@
+# coding=utf-8
+
+from os.path import join
+
+from freehp.api import ProxiesEndpoint, ProxyPool, get_pool_records, pack_pool, publish_pool, open_pool
+from freehp.manager import ProxyQueue, ProxyInfo
+
+
+def make_queue():
+    queue = ProxyQueue()
+    queue.add_proxy(ProxyInfo('127.0.0.1:1', 100, good=5, bad=5, fail=0, anonymity=2, https=True))
+    queue.add_proxy(ProxyInfo('127.0.0.1:2', 200, good=9, bad=1, fail=0, anonymity=0, post=True))
+    queue.add_proxy(ProxyInfo('127.0.0.1:3', 300, good=0, bad=3, fail=3))
+    return queue
+
+
+def test_pool_file(tmpdir):
+    queue = make_queue()
+    fname = join(str(tmpdir), 'pool.bin')
+    publish_pool(fname, *get_pool_records(queue))
+    pool = open_pool(fname)
+    assert pool.generation == queue.generation
+    assert len(pool) == 2
+    endpoint = ProxiesEndpoint()
+    for kwargs in [{}, {'order': 'time'}, {'detail': True}, {'https': True}, {'post': True},
+                   {'min_anonymity': 1}, {'order': 'time', 'detail': True, 'min_anonymity': 2}]:
+        assert endpoint.get_response(pool, 0, **kwargs) == ProxiesEndpoint().get_response(queue, 0, **kwargs)
+    pool.close()
+
+
+def test_pool_queries():
+    queue = ProxyQueue()
+    for i in range(100):
+        queue.add_proxy(ProxyInfo('127.0.0.1:{}'.format(i + 1), 1000 - i * 7 % 100, good=i * 37 % 50,
+                                  bad=i % 11, fail=0, anonymity=i % 3, https=i % 2 == 0, post=i % 5 == 0,
+                                  check_time=i * 13 % 97, latency=i / 100 if i % 4 else None))
+    pool = ProxyPool(pack_pool(*get_pool_records(queue)))
+    for kwargs in [{}, {'https': True}, {'post': True}, {'min_anonymity': 1}, {'https': True, 'min_anonymity': 2}]:
+        for count in [0, 1, 10, 1000]:
+            for order in ['rate', 'time']:
+                # ties are kept in the order of the index
+                matched = [p for p in queue.get_proxies(order=order)
+                           if p.anonymity >= kwargs.get('min_anonymity', 0)
+                           and (p.https or not kwargs.get('https')) and (p.post or not kwargs.get('post'))]
+                expected = [(p.addr, p.good, p.bad, p.anonymity, p.https, p.post, p.check_time, p.latency)
+                            for p in matched[:count or None]]
+                assert [tuple(p) for p in pool.get_proxies(count, order=order, **kwargs)] == expected
+            res = pool.get_proxies(count, **kwargs)
+            assert len(res) == len(queue.get_proxies(count, **kwargs))
+            assert {p.addr for p in res} <= {p.addr for p in queue.get_proxies(**kwargs)}
+
+
+def test_response_cache():
+    queue = make_queue()
+    endpoint = ProxiesEndpoint(cache_size=1)
+    body, etag = endpoint.get_response(queue, 0)
+    assert body == b'["127.0.0.1:2", "127.0.0.1:1"]'
+    assert endpoint.get_response(queue, 0) == (body, etag)
+    queue.add_proxy(ProxyInfo('127.0.0.1:4', 400, good=1, fail=0))
+    assert endpoint.get_response(queue, 0)[1] != etag
+
+
+def test_pack_copied_records():
+    queue = make_queue()
+    records = get_pool_records(queue)
+    p = queue.get_proxies(order='rate')[0]
+    queue.feed_back(p, (True, 1))
+    queue.add_proxy(ProxyInfo('127.0.0.1:4', 400, good=1, fail=0))
+    pool = ProxyPool(pack_pool(*records))
+    assert pool.generation == records[0] != queue.generation
+    assert [(i.addr, i.good, i.anonymity) for i in pool.get_proxies(order='rate')] == \
+        [('127.0.0.1:2', 9, 0), ('127.0.0.1:1', 5, 2)]
@@ -0,0 +1,46 @@
+# coding=utf-8
+
+import json
+
+from freehp import bench
+
+
+def test_summarize():
+    res = bench.summarize('case', {'size': 1}, [0.004, 0.001, 0.002, 0.003], 0.01, peak_memory=1024)
+    assert res['ops'] == 4
+    assert res['ops_per_sec'] == 400
+    assert res['latency']['p50'] == 0.003 and res['latency']['max'] == 0.004
+    assert res['peak_memory'] == 1024
+    # concurrent operations overlap, the mean latency is not the inverse of the throughput
+    res = bench.summarize('case', {}, [0.02, 0.03, 0.04, 0.03], 0.01)
+    assert abs(res['latency']['mean'] - 0.03) < 1e-9
+
+
+def test_small_suites():
+    results = bench.bench_queue(sizes=[100], ops=50)
+    results += bench.bench_query(size=100, ops=2)
+    results += bench.bench_extract(sizes=[10], ops=1)
+    assert all(r['ops'] > 0 and r['ops_per_sec'] > 0 for r in results)
+    assert all(r['peak_memory'] for r in results)
+    assert bench.bench_queue(sizes=[100], ops=50, memory=False)[0]['peak_memory'] is None
+    json.dumps(results)
+
+
+def test_feed_back_reschedules_proxies():
+    queue = bench.make_proxy_queue(100, bench.random.Random(0))
+    popped = set()
+    for i in range(100):
+        proxy = queue.get_expired_proxy()
+        assert proxy not in popped
+        popped.add(proxy)
+        proxy.check_time = int(bench.time.time())
+        queue.feed_back(proxy, (True, 2))
+    assert queue.get_expired_proxy() is None
+
+
+def test_page_layouts():
+    for layout in bench.PAGE_LAYOUTS:
+        page = bench.make_page(50, layout, bench.random.Random(1))
+        n = len(bench.extract_proxies(page))
+        # numbers following the port in noisy pages may be taken as ports as well
+        assert n >= 50 if layout == 'noisy' else n == 50
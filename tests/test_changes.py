@@ -0,0 +1,51 @@
+# coding=utf-8
+
+from freehp.changes import ChangeLog
+from freehp.manager import ProxyQueue, ProxyInfo
+
+
+def test_change_log(loop):
+    log = ChangeLog(maxlen=3, loop=loop)
+    queue = ProxyQueue(min_anonymity=1, change_log=log)
+    p1 = ProxyInfo('127.0.0.1:1', 0)
+    p2 = ProxyInfo('127.0.0.1:2', 0)
+    queue.feed_back(p1, (True, 1))
+    queue.feed_back(p2, False)
+    assert [(c['op'], c['address']) for c in log.get_changes(0)] == [('add', '127.0.0.1:1')]
+    queue.feed_back(p1, (True, 2))
+    queue.set_label(p1, https=True)
+    queue.set_label(p1, https=True)
+    assert [(c['op'], c['anonymity'], c['https']) for c in log.get_changes(1)] == [('update', 2, False),
+                                                                                   ('update', 2, True)]
+    queue.feed_back(p1, (True, 0))
+    assert log.get_changes(3)[0]['op'] == 'remove'
+    assert set(log.get_changes(3)[0]) == {'seq', 'op', 'address', 'anonymity', 'https', 'post'}
+    assert log.get_changes(4) == []
+    assert log.get_changes(0) is None
+    assert log.get_changes(5) is None
+
+
+def test_change_log_follows_served_proxies(loop):
+    log = ChangeLog(loop=loop)
+    queue = ProxyQueue(change_log=log)
+    # restored from a snapshot with fail=0 but not served until it passes the check
+    restored = ProxyInfo('127.0.0.1:1', 0, good=5, fail=0)
+    queue.feed_back(restored, (True, 0))
+    assert [(c['op'], c['address']) for c in log.get_changes(0)] == [('add', '127.0.0.1:1')]
+    p1 = ProxyInfo('127.0.0.1:2', 0)
+    p2 = ProxyInfo('127.0.0.1:3', 0)
+    queue.feed_back(p1, (True, 0))
+    queue.feed_back(p2, (True, 0))
+    assert len(queue.get_expired_proxies()) == 3
+    # a client resets while the proxies are being rechecked
+    seq = log.seq
+    served = {p.addr for p in queue.get_proxies()}
+    queue.feed_back(restored, (True, 0))
+    queue.feed_back(p1, (True, 0))
+    queue.feed_back(p2, False)
+    for c in log.get_changes(seq):
+        if c['op'] == 'add':
+            served.add(c['address'])
+        elif c['op'] == 'remove':
+            served.discard(c['address'])
+    assert served == {p.addr for p in queue.get_proxies()} == {'127.0.0.1:1', '127.0.0.1:2'}
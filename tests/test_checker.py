@@ -1,10 +1,14 @@
 # coding=utf-8
 
+import asyncio
+
 import aiohttp
 from aiohttp import web
 import async_timeout
 
 from freehp.checker import HttpbinChecker
+from freehp.config import Config
+from freehp.judge import make_judge_app
 
 
 async def make_proxy_server(aiohttp_server, loop):
@@ -31,3 +35,32 @@ class TestHttpbinChecker:
         assert res and res[0] is True
         res = await checker.check_proxy("{}:{}".format(server.host, server.port - 1))
         assert not res
+        await checker.close()
+
+    async def test_check_proxy_with_local_judge(self, aiohttp_server, loop):
+        judge = await aiohttp_server(make_judge_app(loop=loop))
+        server = await make_proxy_server(aiohttp_server, loop)
+        judge_url = 'http://{}:{}'.format(judge.host, judge.port)
+        checker = HttpbinChecker(loop=loop, origin_ip='1.2.3.4', judge_urls=[judge_url])
+        res = await checker.check_proxy("{}:{}".format(server.host, server.port))
+        assert res == (True, 2)
+        assert await checker.verify_post("{}:{}".format(server.host, server.port)) is False
+        await checker.close()
+
+
+class _Manager:
+    def __init__(self, config, loop):
+        self.config = config
+        self.loop = loop
+
+
+def test_pool_size_follows_max_clients():
+    loop = asyncio.new_event_loop()
+    try:
+        checker = HttpbinChecker.from_manager(_Manager(Config({'checker_max_clients': 300}), loop))
+        assert checker.pool_size == 600
+        checker = HttpbinChecker.from_manager(_Manager(Config({'checker_max_clients': 300,
+                                                                'checker_pool_size': 50}), loop))
+        assert checker.pool_size == 50
+    finally:
+        loop.close()
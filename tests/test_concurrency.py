@@ -0,0 +1,58 @@
+# coding=utf-8
+
+import asyncio
+
+from freehp.concurrency import ConcurrencyController
+
+
+def test_increase_on_backlog(loop):
+    c = ConcurrencyController(10, 50, 10, increase_step=10, loop=loop)
+    c.in_flight = 10
+    assert c.adjust(backlog=100) == 20
+    c.in_flight = 20
+    assert c.adjust(backlog=100) == 30
+    c.in_flight = 30
+    assert c.adjust(backlog=100) == 40
+    c.in_flight = 40
+    assert c.adjust(backlog=100) == 50
+    c.in_flight = 50
+    assert c.adjust(backlog=100) == 50
+
+
+def test_decrease_on_latency_inflation(loop):
+    c = ConcurrencyController(10, 500, 100, decrease_factor=0.5, loop=loop)
+    c.in_flight = 100
+    for i in range(10):
+        c.record(0.5, True)
+    assert c.adjust(backlog=100) == 110
+    c.in_flight = 110
+    for i in range(10):
+        c.record(5, True)
+    assert c.adjust(backlog=100) == 55
+
+
+def test_decrease_on_timeout_rate(loop):
+    c = ConcurrencyController(10, 500, 100, decrease_factor=0.5, loop=loop)
+    c.in_flight = 50
+    for i in range(10):
+        c.record(10, False, timeout=i < 5)
+    assert c.adjust(backlog=0) == 100
+    for i in range(10):
+        c.record(10, False, timeout=True)
+    assert c.adjust(backlog=0) == 50
+
+
+def test_shrink_when_idle(loop):
+    c = ConcurrencyController(10, 500, 100, increase_step=10, loop=loop)
+    assert c.adjust(backlog=0) == 90
+
+
+async def test_acquire_and_release(loop):
+    c = ConcurrencyController(1, 10, 1, loop=loop)
+    await c.acquire()
+    f = asyncio.ensure_future(c.acquire(), loop=loop)
+    await asyncio.sleep(0.01, loop=loop)
+    assert not f.done()
+    c.release()
+    await asyncio.sleep(0.01, loop=loop)
+    assert f.done() and c.in_flight == 1
@@ -1,6 +1,6 @@
 # coding=utf-8
 
-from freehp.extractor import extract_proxies
+from freehp.extractor import extract_proxies, ProxyExtractor, MAX_PENDING_MARKUP
 
 
 def test_extract_from_table():
@@ -24,3 +24,40 @@ def test_extract_from_list():
 def test_extract_form_text():
     html = '193.242.178.90:8080,194.182.81.120:80'
     assert extract_proxies(html) == ['193.242.178.90:8080', '194.182.81.120:80']
+
+
+def test_extract_from_chunks():
+    html = '<html><head><title>1.1.1.1:8080</title></head><body><table>'
+    html += ''.join('<tr><td>10.0.{}.{}</td><td>{}</td></tr>'.format(i // 256, i % 256, 2000 + i) for i in range(1000))
+    html += '</table><!-- 2.2.2.2:8080 --></body></html>'
+    expected = ['10.0.{}.{}:{}'.format(i // 256, i % 256, 2000 + i) for i in range(1000)]
+    assert extract_proxies(html) == expected
+    for size in (1, 7, 1024):
+        extractor = ProxyExtractor()
+        for i in range(0, len(html), size):
+            extractor.feed(html[i:i + size])
+        assert extractor.close() == expected
+
+
+def test_extract_from_long_text():
+    text = '\n'.join('10.0.{}.{}:{}'.format(i // 256, i % 256, 2000 + i) for i in range(10000))
+    expected = ['10.0.{}.{}:{}'.format(i // 256, i % 256, 2000 + i) for i in range(10000)]
+    extractor = ProxyExtractor()
+    for i in range(0, len(text), 4096):
+        extractor.feed(text[i:i + 4096])
+    assert extractor.close() == expected
+
+
+def test_extract_after_stray_less_than():
+    html = '<body><pre>a < b\n' + '\n'.join('10.0.{}.{}:{}'.format(i // 256, i % 256, 2000 + i) for i in range(10000))
+    expected = ['10.0.{}.{}:{}'.format(i // 256, i % 256, 2000 + i) for i in range(10000)]
+    extractor = ProxyExtractor()
+    for i in range(0, len(html), 1024):
+        extractor.feed(html[i:i + 1024])
+        assert len(extractor._pending) <= MAX_PENDING_MARKUP
+    assert extractor.close() == expected
+
+
+def test_invalid_address():
+    html = '0.1.2.3:8080 256.1.1.1:8080 1.1.1.1:1024 1.1.1.1:65536 001.1.1.1:80'
+    assert extract_proxies(html) == ['001.1.1.1:80']
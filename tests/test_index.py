@@ -0,0 +1,44 @@
+# coding=utf-8
+
+import random
+
+from freehp.index import SortedIndex, DEFAULT_LOAD
+
+
+def test_sorted_index():
+    rnd = random.Random(0)
+    index = SortedIndex(load=4)
+    expected = {}
+    seq = 0
+    for i in range(2000):
+        item = rnd.randint(0, 200)
+        if rnd.random() < 0.3:
+            index.discard(item)
+            expected.pop(item, None)
+        else:
+            key = rnd.randint(0, 50)
+            seq += 1
+            index.add(item, key)
+            expected[item] = (key, seq)
+        assert len(index) == len(expected)
+    assert list(index) == sorted(expected, key=lambda k: expected[k])
+    assert all(item in index for item in expected)
+    assert all(0 < len(b) <= 8 for b in index._buckets)
+
+
+def test_sorted_index_buckets_stay_bounded():
+    # updates only move the entries of one bucket, so buckets must not grow with the size of the index
+    rnd = random.Random(0)
+    index = SortedIndex()
+    for i in range(100000):
+        index.add(i, rnd.randrange(1000))
+    for i in range(100000):
+        item = rnd.randrange(100000)
+        if rnd.random() < 0.3:
+            index.discard(item)
+        else:
+            index.add(item, rnd.randrange(1000))
+    assert all(0 < len(b) <= 2 * DEFAULT_LOAD for b in index._buckets)
+    assert len(index._buckets) == len(index._maxes)
+    assert sum(len(b) for b in index._buckets) == len(index)
+    assert all(b[-1] == m for b, m in zip(index._buckets, index._maxes))
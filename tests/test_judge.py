@@ -0,0 +1,28 @@
+# coding=utf-8
+
+from freehp.checker import HttpbinChecker
+from freehp.judge import make_judge_app
+
+
+async def test_echo(aiohttp_client, loop):
+    client = await aiohttp_client(make_judge_app(loop=loop))
+    resp = await client.get('/get?show_env=1&seed=123', headers={'X-Forwarded-For': '1.2.3.4', 'via': '1.1 proxy'})
+    data = await resp.json()
+    assert data['args'] == {'show_env': '1', 'seed': '123'}
+    assert data['headers']['Via'] == '1.1 proxy, 1.1 freehp'
+    assert data['origin'].startswith('1.2.3.4, ')
+    resp = await client.post('/post', data={'seed': '456'})
+    data = await resp.json()
+    assert data['form'] == {'seed': '456'}
+    assert ',' not in data['origin']
+    assert data['headers']['Via'] == '1.1 freehp'
+
+
+async def test_proxy_with_via_is_not_elite(aiohttp_client, loop):
+    client = await aiohttp_client(make_judge_app(loop=loop))
+    checker = HttpbinChecker(loop=loop)
+    resp = await client.get('/get?show_env=1')
+    assert checker._is_elite_proxy(await resp.json()) is True
+    # a proxy which only announces itself in 'Via'
+    resp = await client.get('/get?show_env=1', headers={'Via': '1.1 squid'})
+    assert checker._is_elite_proxy(await resp.json()) is False
@@ -0,0 +1,276 @@
+# coding=utf-8
+
+import time
+import heapq
+import socket
+import asyncio
+from os.path import join
+
+from aiohttp import web
+
+from freehp.config import Config
+from freehp.manager import ProxyManager, ProxyQueue, ProxyInfo, RecheckPolicy
+from freehp.snapshot import dump_snapshot
+
+
+class TestProxyQueue:
+    def test_get_expired_proxies_in_deadline_order(self):
+        t = int(time.time())
+        queue = ProxyQueue()
+        p1 = ProxyInfo('127.0.0.1:1001', t - 10)
+        p2 = ProxyInfo('127.0.0.1:1002', t + 100)
+        p3 = ProxyInfo('127.0.0.1:1003', t - 20)
+        queue.feed_back(p1, (True, 0))
+        queue.feed_back(p2, (True, 0))
+        queue.feed_back(p3, False)
+        assert len(queue) == 3
+        assert queue.next_timestamp() == t - 20
+        assert queue.get_expired_proxies() == [p3, p1]
+        assert queue.get_expired_proxy() is None
+        assert set(queue.get_proxies()) == {p1, p2}
+
+    def test_drop_proxy_exceeding_max_fail_times(self):
+        t = int(time.time())
+        queue = ProxyQueue(max_fail_times=1)
+        p = ProxyInfo('127.0.0.1:1001', t - 10)
+        queue.feed_back(p, False)
+        assert len(queue) == 0
+        assert queue.next_timestamp() is None
+
+    def test_filter_by_min_anonymity(self):
+        t = int(time.time())
+        queue = ProxyQueue(min_anonymity=1)
+        p = ProxyInfo('127.0.0.1:1001', t + 10, fail=0)
+        queue.feed_back(p, (True, 0))
+        assert p.fail == 1 and p.bad == 1
+        assert queue.get_proxies() == []
+
+    def test_query_proxies_by_index(self):
+        t = int(time.time())
+        queue = ProxyQueue()
+        proxies = []
+        for i in range(20):
+            p = ProxyInfo('127.0.0.1:{}'.format(1000 + i), t + 100 + i, good=i % 7)
+            queue.feed_back(p, (True, i % 3))
+            queue.set_label(p, https=i % 2 == 0, post=i % 4 == 0)
+            proxies.append(p)
+        assert sorted(queue.get_proxies(), key=lambda p: p.addr) == proxies
+        for count in (0, 1, 3, 50):
+            for https in (False, True):
+                for post in (False, True):
+                    for min_anonymity in (0, 1, 2):
+                        matched = [p for p in proxies if p.anonymity >= min_anonymity
+                                   and (not https or p.https) and (not post or p.post)]
+                        n = min(count, len(matched)) if count > 0 else len(matched)
+                        for order in ('rate', 'time'):
+                            key = (lambda p: p.rate) if order == 'rate' else (lambda p: p.timestamp)
+                            expected = sorted(matched, key=key, reverse=True)[:n]
+                            res = queue.get_proxies(count, order=order, https=https, post=post,
+                                                    min_anonymity=min_anonymity)
+                            assert [key(p) for p in res] == [key(p) for p in expected]
+                        res = queue.get_proxies(count, https=https, post=post, min_anonymity=min_anonymity)
+                        assert len(res) == n and set(res) <= set(matched)
+
+    def test_keep_expired_proxy_until_fed_back(self):
+        t = int(time.time())
+        queue = ProxyQueue()
+        p = ProxyInfo('127.0.0.1:1001', t - 10)
+        queue.feed_back(p, (True, 2))
+        queue.set_label(p, https=True, post=True)
+        assert queue.get_proxies(1, order='rate', https=True, post=True, min_anonymity=2) == [p]
+        assert queue.get_expired_proxies() == [p]
+        assert queue.get_proxies(order='rate', https=True) == [p]
+        queue.feed_back(p, (True, 1))
+        assert queue.get_proxies(min_anonymity=2) == []
+        assert queue.get_proxies(min_anonymity=1) == [p]
+        queue.feed_back(p, False)
+        assert queue.get_proxies(order='rate', https=True) == []
+        assert queue.count_by_anonymity() == {1: 0, 2: 0}
+
+    def test_generation(self):
+        t = int(time.time())
+        queue = ProxyQueue()
+        g = queue.generation
+        p = ProxyInfo('127.0.0.1:1001', t - 10)
+        queue.feed_back(p, False)
+        assert queue.generation == g
+        queue.feed_back(p, (True, 0))
+        assert queue.generation > g
+        g = queue.generation
+        queue.set_label(p, https=False, post=False)
+        assert queue.generation == g
+        queue.set_label(p, https=True, post=False)
+        assert queue.generation > g
+        g = queue.generation
+        queue.get_expired_proxies()
+        assert queue.generation == g
+        queue.feed_back(p, False)
+        assert queue.generation > g
+
+
+class TestRecheckPolicy:
+    def test_get_interval(self):
+        policy = RecheckPolicy(300, min_interval=60, max_interval=3600)
+        queue = ProxyQueue(max_fail_times=100, recheck_policy=policy)
+        p = ProxyInfo('127.0.0.1:1001', 0)
+        queue.feed_back(p, (True, 0))
+        assert p.timestamp == 60
+        intervals = []
+        for i in range(20):
+            queue.feed_back(p, (True, 0))
+            intervals.append(p.timestamp)
+        assert intervals == sorted(intervals)
+        assert intervals[0] == 300 and intervals[-1] == 3600
+        queue.feed_back(p, False)
+        assert p.timestamp == 60
+        queue.feed_back(p, (True, 0))
+        assert 60 <= p.timestamp < 300
+
+
+class StubChecker:
+    def __init__(self, loop):
+        self.loop = loop
+        self.events = []
+        self.http = (True, 0)
+        self.https = (True, 2)
+        self.post = True
+
+    @classmethod
+    def from_manager(cls, manager):
+        return cls(manager.loop)
+
+    async def check_proxy(self, addr, https=False):
+        if not https:
+            return self.http
+        return await self._probe('https', self.https)
+
+    async def verify_post(self, addr):
+        return await self._probe('post', self.post)
+
+    async def _probe(self, kind, res):
+        self.events.append((kind, 'start'))
+        await asyncio.sleep(0.05, loop=self.loop)
+        self.events.append((kind, 'end'))
+        return res
+
+
+def make_stub_manager(**kwargs):
+    config = {'origin_ip': '127.0.0.1', 'checker': 'tests.test_manager.StubChecker', 'label_interval': 3600}
+    config.update(kwargs)
+    return ProxyManager(Config(config))
+
+
+def make_block_manager(block_time):
+    manager = ProxyManager.__new__(ProxyManager)
+    manager._proxy_db = {}
+    manager._block_heap = []
+    manager._block_time = block_time
+    return manager
+
+
+class TestProxyManager:
+    def test_remove_blocked_proxies(self):
+        manager = make_block_manager(100)
+        proxies = [ProxyInfo('127.0.0.1:{}'.format(1001 + i), i * 10) for i in range(5)]
+        for p in proxies:
+            manager._proxy_db[p.key] = p
+            heapq.heappush(manager._block_heap, (p.timestamp + 100, p.key))
+        # the proxy was seen again after being pushed
+        proxies[1].timestamp = 200
+        assert manager._remove_blocked_proxies(125) is True
+        assert set(manager._proxy_db) == {proxies[1].key, proxies[3].key, proxies[4].key}
+        assert sorted(manager._block_heap) == [(130, proxies[3].key), (140, proxies[4].key),
+                                               (300, proxies[1].key)]
+        assert manager._remove_blocked_proxies(150) is True
+        assert set(manager._proxy_db) == {proxies[1].key}
+        assert manager._block_heap == [(300, proxies[1].key)]
+
+    def test_remove_blocked_proxies_in_batches(self):
+        manager = make_block_manager(10)
+        for i in range(25):
+            p = ProxyInfo('127.0.0.1:{}'.format(1001 + i), i)
+            manager._proxy_db[p.key] = p
+            heapq.heappush(manager._block_heap, (p.timestamp + 10, p.key))
+        assert manager._remove_blocked_proxies(100, batch_size=10) is False
+        assert len(manager._proxy_db) == 15
+        assert manager._remove_blocked_proxies(100, batch_size=10) is False
+        assert manager._remove_blocked_proxies(100, batch_size=10) is True
+        assert len(manager._proxy_db) == 0 and len(manager._block_heap) == 0
+
+    def test_restore_snapshot(self, tmpdir, loop):
+        fname = join(str(tmpdir), 'snapshot.gz')
+        dump_snapshot(fname, [['127.0.0.1:1001', 1000, 1, 9, 0, 0, False, False, 900, 0, 1, 'a', None],
+                              ['127.0.0.1:1002', 2000, 9, 1, 0, 2, True, True, 1900, 1800, 0xff, 'b', 0.5],
+                              ['127.0.0.1:1003', 3000, 5, 5, 1, 0, False, False, 2900, 0, 0, 'a', 1.0],
+                              ['127.0.0.1:1004', 4000, 0, 9, 4, 0, False, False, 3900, 0, 0, None, None],
+                              ['127.0.0.1', 5000, 1, 0, 0, 0, False, False, 4900, 0, 1, None, None]])
+        manager = make_block_manager(100)
+        manager._snapshot_file = fname
+        manager._max_fail_times = 3
+        manager._wait_queue = asyncio.Queue(loop=loop)
+        t = int(time.time())
+        manager._restore_snapshot()
+        assert len(manager._proxy_db) == 4
+        assert {key for _, key in manager._block_heap} == set(manager._proxy_db)
+        for expire_at, key in manager._block_heap:
+            assert t + 100 <= expire_at <= int(time.time()) + 100
+            assert manager._proxy_db[key].timestamp == expire_at - 100
+        # restored proxies are not removed from DB before being verified
+        assert manager._remove_blocked_proxies(time.time()) is True
+        assert len(manager._proxy_db) == 4
+        p = manager._proxy_db[ProxyInfo('127.0.0.1:1002', 0).key]
+        assert (p.good, p.bad, p.fail, p.anonymity, p.https, p.post) == (9, 1, 0, 2, True, True)
+        assert (p.check_time, p.label_time, p.history, p.source, p.latency) == (1900, 1800, 0xff, 'b', 0.5)
+        # proxies exceeding max fail times are kept in DB but not verified
+        queued = []
+        while not manager._wait_queue.empty():
+            queued.append(manager._wait_queue.get_nowait().addr)
+        assert queued == ['127.0.0.1:1002', '127.0.0.1:1001', '127.0.0.1:1003']
+
+    async def test_screen_proxy(self, aiohttp_server, loop):
+        server = await aiohttp_server(web.Application(loop=loop))
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        closed_port = sock.getsockname()[1]
+        sock.close()
+        manager = ProxyManager(Config({'origin_ip': '127.0.0.1', 'screen_timeout': 5}))
+        listening = ProxyInfo('127.0.0.1:{}'.format(server.port), 0)
+        unreachable = ProxyInfo('127.0.0.1:{}'.format(closed_port), 0)
+        await manager._screen_proxy(unreachable)
+        await manager._screen_proxy(listening)
+        assert manager._stage_stats['screen'] == [1, 1]
+        assert manager._wait_queue.qsize() == 1
+        assert manager._wait_queue.get_nowait() is listening
+
+    async def test_label_proxy(self, loop):
+        manager = make_stub_manager()
+        checker = manager._checker
+        proxy = ProxyInfo('127.0.0.1:1001', int(time.time()) + 100, fail=0)
+        manager._proxy_queue.add_proxy(proxy)
+        await manager._label_proxy(proxy)
+        # both probes run at the same time
+        assert [e[1] for e in checker.events] == ['start', 'start', 'end', 'end']
+        assert proxy.https is True and proxy.post is True
+        assert proxy.label_time >= proxy.timestamp - 100
+        assert manager._proxy_queue.get_proxies(https=True, post=True) == [proxy]
+        # HTTPS through a transparent proxy does not count
+        checker.https = (True, 0)
+        checker.post = False
+        await manager._label_proxy(proxy)
+        assert proxy.https is False and proxy.post is False
+        assert manager._proxy_queue.get_proxies(https=True) == []
+        assert manager._proxy_queue.get_proxies(post=True) == []
+
+    async def test_skip_relabelling(self, loop):
+        manager = make_stub_manager()
+        t = int(time.time())
+        labelled = ProxyInfo('127.0.0.1:1001', t, label_time=t - 60)
+        stale = ProxyInfo('127.0.0.1:1002', t, label_time=t - 7200)
+        await manager._check_proxy(labelled)
+        await manager._check_proxy(stale)
+        assert manager._label_queue.qsize() == 1
+        assert manager._label_queue.get_nowait() is stale
+        manager._checker.http = False
+        stale.label_time = 0
+        await manager._check_proxy(stale)
+        assert manager._label_queue.qsize() == 0
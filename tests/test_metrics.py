@@ -0,0 +1,30 @@
+# coding=utf-8
+
+from freehp.metrics import Registry, Counter, Gauge, Histogram
+
+
+def test_render_metrics():
+    registry = Registry()
+    c = Counter('test_total', 'Test counter', ['source'], registry=registry)
+    c.labels('a').inc()
+    c.labels('a').inc(2)
+    c.labels('b"c').inc()
+    Gauge('test_size', 'Test gauge', ['queue'], registry=registry, callback=lambda: {'wait': 3})
+    h = Histogram('test_seconds', 'Test histogram', registry=registry, buckets=(0.1, 1))
+    h.observe(0.1)
+    h.observe(0.5)
+    h.observe(5)
+    assert registry.render() == ('# HELP test_total Test counter\n'
+                                 '# TYPE test_total counter\n'
+                                 'test_total{source="a"} 3\n'
+                                 'test_total{source="b\\"c"} 1\n'
+                                 '# HELP test_size Test gauge\n'
+                                 '# TYPE test_size gauge\n'
+                                 'test_size{queue="wait"} 3\n'
+                                 '# HELP test_seconds Test histogram\n'
+                                 '# TYPE test_seconds histogram\n'
+                                 'test_seconds_bucket{le="0.1"} 1\n'
+                                 'test_seconds_bucket{le="1"} 2\n'
+                                 'test_seconds_bucket{le="+Inf"} 3\n'
+                                 'test_seconds_sum 5.6\n'
+                                 'test_seconds_count 3\n')
@@ -0,0 +1,36 @@
+# coding=utf-8
+
+import gzip
+import json
+from os.path import join
+
+import pytest
+
+from freehp.snapshot import dump_snapshot, load_snapshot, FIELDS
+
+
+def test_dump_and_load_snapshot(tmpdir):
+    fname = join(str(tmpdir), 'snapshot.gz')
+    records = [['127.0.0.1:1001', 1500000000, 10, 2, 0, 2, True, False, 1499999700, 1499999000, 0xff, 'a', 0.25],
+               ['127.0.0.1:1002', 1500000300, 0, 4, 4, 0, False, False, 1500000000, 0, 0, None, None]]
+    dump_snapshot(fname, records)
+    res = load_snapshot(fname)
+    assert [[r[i] for i in FIELDS] for r in res] == records
+    dump_snapshot(fname, records[:1])
+    assert len(load_snapshot(fname)) == 1
+    assert tmpdir.listdir() == [tmpdir.join('snapshot.gz')]
+
+
+def test_load_old_snapshot(tmpdir):
+    fname = join(str(tmpdir), 'snapshot.gz')
+    fields = FIELDS[:11]
+    with gzip.open(fname, 'wb') as f:
+        f.write(json.dumps({'version': 1, 'fields': fields,
+                            'records': [['127.0.0.1:1001', 1500000000, 10, 2, 0, 2, True, False, 1499999700,
+                                         1499999000, 0xff]]}).encode('utf-8'))
+    res = load_snapshot(fname)
+    assert res[0]['addr'] == '127.0.0.1:1001' and 'latency' not in res[0]
+    with gzip.open(fname, 'wb') as f:
+        f.write(json.dumps({'version': 100, 'fields': fields, 'records': []}).encode('utf-8'))
+    with pytest.raises(ValueError):
+        load_snapshot(fname)
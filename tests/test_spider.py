@@ -0,0 +1,123 @@
+# coding=utf-8
+
+import asyncio
+
+from aiohttp import web
+
+from freehp.config import Config
+from freehp.spider import ExtractorPool, ProxySpider, SourceStats, TokenBucket
+
+
+async def test_extractor_pool(loop):
+    for mode in ('thread', 'process'):
+        pool = ExtractorPool(mode, max_workers=2, batch_size=100, loop=loop)
+        pages = ['1.1.1.{}:8080'.format(i).encode() for i in range(1, 30)]
+        res = await asyncio.gather(*[pool.extract(p) for p in pages], loop=loop)
+        assert res == [['1.1.1.{}:8080'.format(i)] for i in range(1, 30)]
+        pool.close()
+
+
+def test_source_stats():
+    stats = SourceStats()
+    assert stats.score is None
+    stats.record_scrape(100, 10)
+    stats.passed = 4
+    assert stats.new_per_scrape == 10
+    assert stats.score == 10 * 5 / 12
+    stats.record_scrape(100, 0)
+    assert stats.new_per_scrape < 10
+    assert stats.to_dict()['scrapes'] == 2
+
+
+async def test_fetch_unchanged_page(aiohttp_server, loop):
+    requests = []
+
+    async def etag_page(request):
+        requests.append(request.headers.get('If-None-Match'))
+        if request.headers.get('If-None-Match') == '"v1"':
+            return web.Response(status=304)
+        return web.Response(text='1.1.1.1:8080', headers={'ETag': '"v1"'})
+
+    async def plain_page(request):
+        return web.Response(text='2.2.2.2:8080')
+
+    app = web.Application(loop=loop)
+    app.router.add_route('GET', '/etag', etag_page)
+    app.router.add_route('GET', '/plain', plain_page)
+    server = await aiohttp_server(app)
+    spider = ProxySpider(Config(), loop=loop)
+    etag_url = 'http://{}:{}/etag'.format(server.host, server.port)
+    plain_url = 'http://{}:{}/plain'.format(server.host, server.port)
+    assert await spider._fetch(etag_url) == ['1.1.1.1:8080']
+    assert await spider._fetch(etag_url) == []
+    assert requests == [None, '"v1"']
+    assert await spider._fetch(plain_url) == ['2.2.2.2:8080']
+    assert await spider._fetch(plain_url) == []
+    await spider.cleanup()
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    async def sleep(self, delay, loop=None):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+def test_token_bucket(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(asyncio, 'sleep', clock.sleep)
+    bucket = TokenBucket(0.5, capacity=2, loop=clock)
+    loop = asyncio.new_event_loop()
+    try:
+        for i in range(4):
+            loop.run_until_complete(bucket.acquire())
+        # the first two requests use up the capacity, the next ones wait for a token every 2 seconds
+        assert clock.sleeps == [2, 2]
+        clock.now += 10
+        clock.sleeps = []
+        for i in range(2):
+            loop.run_until_complete(bucket.acquire())
+        assert clock.sleeps == []
+    finally:
+        loop.close()
+
+
+def test_spider_settings():
+    loop = asyncio.new_event_loop()
+    try:
+        spider = ProxySpider(Config({'spider_sleep_time': 4}), loop=loop)
+        assert spider._rate_limit == 0.25
+        spider = ProxySpider(Config({'spider_sleep_time': 4, 'spider_rate_limit': 2}), loop=loop)
+        assert spider._rate_limit == 2
+    finally:
+        loop.close()
+
+
+def test_retry_delay():
+    loop = asyncio.new_event_loop()
+    try:
+        spider = ProxySpider(Config({'spider_backoff_base': 2, 'spider_backoff_max': 10}), loop=loop)
+        for i, delay in [(1, 2), (2, 4), (3, 8), (4, 10), (10, 10)]:
+            delays = [spider._get_retry_delay(i) for j in range(100)]
+            assert all(delay / 2 <= d <= delay for d in delays)
+            assert len(set(delays)) > 1
+    finally:
+        loop.close()
+
+
+async def test_session_per_host(loop):
+    spider = ProxySpider(Config({'spider_concurrency': 3}), loop=loop)
+    session = spider._get_session('a.com')
+    assert spider._get_session('a.com') is session
+    assert spider._get_session('b.com') is not session
+    assert spider._semaphores['a.com'] is not spider._semaphores['b.com']
+    assert spider._buckets['a.com'] is not spider._buckets['b.com']
+    assert spider._buckets['a.com'].capacity == 3
+    await spider.cleanup()
+    assert not spider._sessions
@@ -0,0 +1,112 @@
+# coding=utf-8
+
+from aiohttp import web
+
+from freehp.squid import Squid, SquidConfig
+
+
+def make_proxies(n, https=False):
+    return [{'address': '127.0.0.1:{}'.format(i), 'anonymity': 2, 'https': https, 'post': False}
+            for i in range(1, n + 1)]
+
+
+def test_need_reload(tmpdir):
+    tpl = tmpdir.join('squid.conf.tpl')
+    tpl.write('http_port 3128\n')
+    squid = Squid(str(tmpdir.join('squid.conf')), str(tpl), config=SquidConfig({'reload_threshold': 0.1}))
+    peers = squid._make_peers(make_proxies(20))
+    assert squid._need_reload(peers) is True
+    squid._applied_peers = peers
+    squid._reload_time = float('inf')
+    assert squid._need_reload(squid._make_peers(make_proxies(20))) is False
+    assert squid._need_reload(squid._make_peers(make_proxies(21))) is False
+    assert squid._need_reload(squid._make_peers(make_proxies(18))) is True
+    assert squid._need_reload(squid._make_peers(make_proxies(20, https=True))) is True
+    squid._reload_time = 0
+    assert squid._need_reload(squid._make_peers(make_proxies(21))) is True
+
+
+def test_write_configuration(tmpdir):
+    tpl = tmpdir.join('squid.conf.tpl')
+    tpl.write('http_port 3128\n')
+    dest = tmpdir.join('squid.conf')
+    squid = Squid(str(dest), str(tpl))
+    squid._write_configuration('http_port 3129\n')
+    assert dest.read() == 'http_port 3129\n'
+    squid._recover_configuration()
+    assert dest.read() == 'http_port 3128\n'
+    assert tmpdir.listdir(lambda p: p.basename.endswith('.tmp')) == []
+
+
+def test_peer_weight(tmpdir):
+    tpl = tmpdir.join('squid.conf.tpl')
+    tpl.write('http_port 3128\n')
+    squid = Squid(str(tmpdir.join('squid.conf')), str(tpl), config=SquidConfig({'min_anonymity': 0}))
+    good = {'address': '127.0.0.1:1', 'success': 98, 'fail': 0, 'anonymity': 2, 'latency': 0.2,
+            'https': True, 'post': True}
+    slow = dict(good, latency=4.0)
+    bad = dict(good, success=1, fail=9, anonymity=0)
+    assert squid._get_peer_weight(good) == (10, 20)
+    assert squid._get_peer_weight(slow) == (2, 5)
+    assert squid._get_peer_weight(bad) == (1, 2)
+    peers = squid._make_peers([good])
+    assert 'weight=10 ' in peers['127.0.0.1.1'][0] and 'max-conn=20 ' in peers['127.0.0.1.1'][0]
+
+
+async def test_maintain_squid(tmpdir, aiohttp_server, loop):
+    calls = []
+
+    async def proxies(request):
+        calls.append(request.path)
+        if request.path == '/https' and len(calls) > 2:
+            return web.Response(status=500)
+        n = 3 if request.path == '/https' else 2
+        return web.json_response(make_proxies(n, https=True))
+
+    app = web.Application(loop=loop)
+    app.router.add_route('GET', '/{tail:.*}', proxies)
+    server = await aiohttp_server(app)
+    tpl = tmpdir.join('squid.conf.tpl')
+    tpl.write('http_port 3128\n')
+    squid = Squid(str(tmpdir.join('squid.conf')), str(tpl), config=SquidConfig({'min_anonymity': 0}))
+    squid._request_urls = ['http://{}:{}/{}'.format(server.host, server.port, i) for i in ('http', 'https')]
+    applied = []
+
+    async def reconfigure_squid(data):
+        applied.append(sorted(i['address'] for i in data))
+
+    squid._reconfigure_squid = reconfigure_squid
+    await squid._maintain_squid()
+    await squid._maintain_squid()
+    assert applied == [['127.0.0.1:1', '127.0.0.1:2', '127.0.0.1:3']] * 2
+    await squid._close_session()
+
+
+async def test_fall_back_on_error_response(tmpdir, aiohttp_server, loop):
+    calls = []
+
+    async def proxies(request):
+        calls.append(request.path)
+        if len(calls) == 2:
+            return web.json_response({'error': 'Internal Server Error'}, status=500)
+        if len(calls) == 3:
+            return web.json_response({'error': 'Unknown'})
+        return web.json_response(make_proxies(2))
+
+    app = web.Application(loop=loop)
+    app.router.add_route('GET', '/{tail:.*}', proxies)
+    server = await aiohttp_server(app)
+    tpl = tmpdir.join('squid.conf.tpl')
+    tpl.write('http_port 3128\n')
+    squid = Squid(str(tmpdir.join('squid.conf')), str(tpl), config=SquidConfig({'min_anonymity': 0}))
+    squid._request_urls = ['http://{}:{}/proxies'.format(server.host, server.port)]
+    applied = []
+
+    async def reconfigure_squid(data):
+        applied.append(sorted(i['address'] for i in data))
+
+    squid._reconfigure_squid = reconfigure_squid
+    for i in range(3):
+        await squid._maintain_squid()
+    assert applied == [['127.0.0.1:1', '127.0.0.1:2']] * 3
+    await squid._close_session()
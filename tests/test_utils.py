@@ -0,0 +1,14 @@
+# coding=utf-8
+
+import pytest
+
+from freehp.utils import pack_addr, unpack_addr
+
+
+def test_pack_addr():
+    for addr in ('1.2.3.4:8080', '255.255.255.255:65535', '0.0.0.0:0'):
+        assert unpack_addr(pack_addr(addr)) == addr
+    assert pack_addr('001.002.003.004:80') == pack_addr('1.2.3.4:80')
+    for addr in ('256.1.1.1:80', '1.256.1.1:80', '1.1.1.1:65536', '1.1.1:80', '1.1.1.1.1:80', 'localhost:80'):
+        with pytest.raises(ValueError):
+            pack_addr(addr)
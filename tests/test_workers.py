@@ -0,0 +1,35 @@
+# coding=utf-8
+
+import os
+import asyncio
+
+from freehp.workers import CheckerWorkerPool
+
+
+class PidChecker:
+    def __init__(self, loop):
+        self.loop = loop
+
+    @classmethod
+    def from_manager(cls, manager):
+        return cls(manager.loop)
+
+    async def check_proxy(self, addr, https=False):
+        await asyncio.sleep(0.01, loop=self.loop)
+        return True, os.getpid()
+
+    async def verify_post(self, addr):
+        return addr != '127.0.0.1:1'
+
+
+async def test_checker_worker_pool(loop):
+    pool = CheckerWorkerPool('tests.test_workers.PidChecker', {'log_level': 'WARNING'}, workers=2, loop=loop)
+    await pool.open()
+    res = await asyncio.gather(*[pool.check_proxy('127.0.0.1:{}'.format(i)) for i in range(20)], loop=loop)
+    assert all(r[0] is True for r in res)
+    assert len(set(r[1] for r in res)) == 2
+    assert await pool.verify_post('127.0.0.1:1') is False
+    assert await pool.verify_post('127.0.0.1:2') is True
+    processes = [w.process for w in pool._workers]
+    await pool.close()
+    assert not any(p.is_alive() for p in processes)